@@ -1,61 +1,107 @@
 import pandas as pd
-import sqlite3
 import json
 import numpy as np
 import os
 from pathlib import Path
 
+import data_access
+from session_index import KEY_FIELDS, SessionIndex
 
-def process_data_table(conn):
+
+# Trial fields read by the three screening checks
+SCREENING_FIELDS = [
+    'trial_type', 'screen_width', 'screen_height', 'form_data',
+    'repeat', 'stimulus_number', 'response_label',
+]
+
+# Data columns needed to expand json_data when the raw table isn't exported
+EXPAND_COLUMNS = ['id', 'worker_id', 'condition', 'json_data']
+
+
+def expand_data_row(row, fields=None):
+    """Flatten one Data row's json_data into a list of trial dicts.
+
+    If fields is given, only those trial keys are copied into the flat
+    trials, so bulky fields (browser_events, view_history, ...) are never
+    re-serialised or kept.
+    """
+    # Get basic info
+    trial_info = {
+        'worker_id': str(row.get('worker_id', '')),
+        'condition': str(row.get('condition', '')),
+        'database_id': str(row.get('id', ''))
+    }
+    
+    flat_trials = []
+    json_str = row.get('json_data', None)
+    if json_str and isinstance(json_str, str):
+        try:
+            # Parse JSON while keeping numbers as strings
+            trials = json.loads(json_str, parse_float=str, parse_int=str)
+            if not isinstance(trials, list):
+                trials = [trials]
+            
+            for trial in trials:
+                if not isinstance(trial, dict):
+                    continue
+                    
+                flat_trial = trial_info.copy()
+                
+                if fields is None:
+                    items = trial.items()
+                else:
+                    items = ((key, trial[key]) for key in fields if key in trial)
+                
+                for key, value in items:
+                    # Force seed and similar fields to remain as strings
+                    if key == 'seed' or (isinstance(value, (int, float)) and value > 1e12):
+                        value = str(value)
+                    elif isinstance(value, str) and value.isdigit() and len(value) > 12:
+                        value = str(value)
+                    
+                    if isinstance(value, (list, dict)):
+                        flat_trial[key] = json.dumps(value)
+                    else:
+                        flat_trial[key] = value
+                
+                flat_trials.append(flat_trial)
+                
+        except json.JSONDecodeError as e:
+            print(f"JSON decode error: {e}")
+    
+    return flat_trials
+
+
+def process_data_table(conn, export_path='Data.csv', fields=None, session_index=None):
+    """Expand every Data row into one row per trial.
+
+    Pass export_path=None to skip the Data.csv export (only the columns
+    needed for expansion are then read) and fields to keep only those trial
+    keys. If a SessionIndex is passed, each trial is indexed as it is
+    expanded and the result gets duplicate_trial and first_session columns.
+    """
     try:
-        # Get the raw data
-        df = pd.read_sql_query('SELECT * FROM Data', conn)
-        
-        # First, export the original Data table as Data.csv
-        df.to_csv('Data.csv', index=False)
-        print('✓ Successfully exported original data to Data.csv')
-        
         all_trials = []
+        columns = EXPAND_COLUMNS if export_path is None else None
+        if session_index is not None and fields is not None:
+            fields = list(fields) + [key for key in KEY_FIELDS if key not in fields]
         
-        for _, row in df.iterrows():
-            # Get basic info
-            trial_info = {
-                'worker_id': str(row.get('worker_id', '')),
-                'condition': str(row.get('condition', '')),
-                'database_id': str(row.get('id', ''))
-            }
+        # Read the raw data page by page, exporting the original Data table
+        # as Data.csv as we go
+        for page_number, page in enumerate(data_access.iter_table(conn, 'Data', columns=columns)):
+            if export_path is not None:
+                page.to_csv(export_path, index=False, mode='w' if page_number == 0 else 'a',
+                            header=page_number == 0)
             
-            json_str = row.get('json_data', None)
-            if json_str and isinstance(json_str, str):
-                try:
-                    # Parse JSON while keeping numbers as strings
-                    trials = json.loads(json_str, parse_float=str, parse_int=str)
-                    if not isinstance(trials, list):
-                        trials = [trials]
-                    
+            for row in page.to_dict('records'):
+                trials = expand_data_row(row, fields=fields)
+                if session_index is not None:
                     for trial in trials:
-                        if not isinstance(trial, dict):
-                            continue
-                            
-                        flat_trial = trial_info.copy()
-                        
-                        for key, value in trial.items():
-                            # Force seed and similar fields to remain as strings
-                            if key == 'seed' or (isinstance(value, (int, float)) and value > 1e12):
-                                value = str(value)
-                            elif isinstance(value, str) and value.isdigit() and len(value) > 12:
-                                value = str(value)
-                            
-                            if isinstance(value, (list, dict)):
-                                flat_trial[key] = json.dumps(value)
-                            else:
-                                flat_trial[key] = value
-                        
-                        all_trials.append(flat_trial)
-                        
-                except json.JSONDecodeError as e:
-                    print(f"JSON decode error: {e}")
-                    continue
+                        session_index.add(trial)
+                all_trials.extend(trials)
+        
+        if export_path is not None:
+            print(f'✓ Successfully exported original data to {export_path}')
     
         if all_trials:
             expanded_df = pd.DataFrame(all_trials)
@@ -69,6 +115,9 @@ def process_data_table(conn):
                     except (ValueError, TypeError):
                         pass
             
+            if session_index is not None:
+                expanded_df = session_index.annotate(expanded_df)
+            
             return expanded_df
         return pd.DataFrame()
     
@@ -164,81 +213,117 @@ def response_reliability_check(df):
     return df[df['worker_id'].isin(passed_participants)]
 
 
+def apply_checks(df):
+    """Run the screen size, seriousness and reliability checks in order."""
+    after_screen_check = screen_size_check(df)
+    print(f"Records after screen size check: {len(after_screen_check)}")
+    
+    after_all_checks = seriousness_self_report_check(after_screen_check)
+    print(f"Records after all checks: {len(after_all_checks)}")
+    
+    after_reliability_check = response_reliability_check(after_all_checks)
+    print(f"Records after reliability check: {len(after_reliability_check)}")
+    
+    return after_reliability_check
+
+
+def screen_participants(conn, fields=SCREENING_FIELDS):
+    """Return the worker_ids that pass all checks.
 
-def create_output_files():
-    database_path = 'database.db'
+    Only the trial fields the checks read are expanded, so this is much
+    lighter than a full process_data_table on a large Data table.
+    """
+    expanded_df = process_data_table(conn, export_path=None, fields=fields)
+    if expanded_df.empty:
+        return []
+    return apply_checks(expanded_df)['worker_id'].unique().tolist()
+
+
+def create_output_files(database_path='database.db', output_dir='.'):
+    """Export and screen database_path into output_dir.
+
+    Returns True only if every table was exported (a database with no trials
+    yet counts as exported); errors are printed.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    participant_exported = False
+    data_exported = False
     
-    with sqlite3.connect(database_path) as conn:
-        # Process Participant table
-        try:
-            participant_df = pd.read_sql_query('SELECT * FROM Participant', conn)
-            participant_df.to_csv('Participant.csv', index=False)
-            print('✓ Successfully exported Participant to Participant.csv')
-        except Exception as e:
-            print(f"Error exporting Participant table: {e}")
+    try:
+        with data_access.connection(database_path) as conn:
+            # Process Participant table
+            try:
+                participant_df = data_access.read_table(conn, 'Participant')
+                participant_df.to_csv(output_dir / 'Participant.csv', index=False)
+                print('✓ Successfully exported Participant to Participant.csv')
+                participant_exported = True
+            except Exception as e:
+                print(f"Error exporting Participant table: {e}")
         
-        # Process Data table
-        try:
-            expanded_df = process_data_table(conn)
-            print("Original DataFrame:")
-            print(expanded_df.head())
-            print(f"Total records before checks: {len(expanded_df)}")
-            
-            if not expanded_df.empty:
-                expanded_df.to_csv(
-                    'Data_expanded.csv',
-                    index=False,
-                    quoting=1,
-                    encoding='utf-8-sig'
+            # Process Data table
+            try:
+                # Flags re-saved trials (duplicate_trial) and later sessions (first_session)
+                session_index = SessionIndex()
+                expanded_df = process_data_table(
+                    conn, export_path=output_dir / 'Data.csv', session_index=session_index
                 )
-                print('✓ Successfully exported complete Data_expanded.csv')
-                
-                # screen size check
-                after_screen_check = screen_size_check(expanded_df)
-                print(f"Records after screen size check: {len(after_screen_check)}")
+                print("Original DataFrame:")
+                print(expanded_df.head())
+                print(f"Total records before checks: {len(expanded_df)}")
+                if not expanded_df.empty:
+                    sessions = session_index.summary()
+                    print(f"Duplicate trials: {int(expanded_df['duplicate_trial'].sum())}")
+                    if not sessions.empty:
+                        print(f"Participants with more than one session: {int(sessions['repeated_session'].sum())}")
+            
+                if not expanded_df.empty:
+                    expanded_df.to_csv(
+                        output_dir / 'Data_expanded.csv',
+                        index=False,
+                        quoting=1,
+                        encoding='utf-8-sig'
+                    )
+                    print('✓ Successfully exported complete Data_expanded.csv')
                 
-                # seriousness check
-                after_all_checks = seriousness_self_report_check(after_screen_check)
-                print(f"Records after all checks: {len(after_all_checks)}")
+                    # screen size, seriousness and reliability checks
+                    after_reliability_check = apply_checks(expanded_df)
 
-                # creen_size and seriousness checks:
-                after_reliability_check = response_reliability_check(after_all_checks)
-                print(f"Records after reliability check: {len(after_reliability_check)}")
-
-                # Use after_reliability_check for final exports
-                passed_participants = after_reliability_check['worker_id'].unique()
+                    # Use after_reliability_check for final exports
+                    passed_participants = after_reliability_check['worker_id'].unique()
                 
-                # Save the filtered expanded data
-                after_reliability_check.to_csv(
-                    'data_expanded_after_checks.csv',
-                    index=False,
-                    quoting=1,
-                    encoding='utf-8-sig'
-                )
-                print('✓ Successfully exported filtered data_expanded_after_checks.csv')
+                    # Save the filtered expanded data
+                    after_reliability_check.to_csv(
+                        output_dir / 'data_expanded_after_checks.csv',
+                        index=False,
+                        quoting=1,
+                        encoding='utf-8-sig'
+                    )
+                    print('✓ Successfully exported filtered data_expanded_after_checks.csv')
                 
-                # Get list of participants who passed all checks
-                passed_participants = after_reliability_check['worker_id'].unique()
+                    # Get list of participants who passed all checks
+                    passed_participants = after_reliability_check['worker_id'].unique()
                 
-                # Filter Participant table
-                passed_participant_df = participant_df[participant_df['worker_id'].isin(passed_participants)]
-                passed_participant_df.to_csv('participants_after_checks.csv', index=False)
-                print('✓ Successfully exported participants_after_checks.csv')
+                    # Filter Participant table
+                    passed_participant_df = participant_df[participant_df['worker_id'].isin(passed_participants)]
+                    passed_participant_df.to_csv(output_dir / 'participants_after_checks.csv', index=False)
+                    print('✓ Successfully exported participants_after_checks.csv')
                 
-                # Filter original Data table format
-                passed_data_df = pd.read_sql_query(
-                    'SELECT * FROM Data WHERE worker_id IN ({})'.format(
-                        ','.join(['"{}"'.format(p) for p in passed_participants])
-                    ), 
-                    conn
-                )
-                passed_data_df.to_csv('data_after_checks.csv', index=False)
-                print('✓ Successfully exported data_after_checks.csv')
+                    # Filter original Data table format
+                    passed_data_df = data_access.read_data_for_workers(conn, passed_participants)
+                    passed_data_df.to_csv(output_dir / 'data_after_checks.csv', index=False)
+                    print('✓ Successfully exported data_after_checks.csv')
+                    data_exported = True
                 
-            else:
-                print('No trial data found to export')
-        except Exception as e:
-            print(f"Error processing Data table: {e}")
+                else:
+                    # Participants who haven't saved any trials yet aren't a failure
+                    print('No trial data found to export')
+                    data_exported = True
+            except Exception as e:
+                print(f"Error processing Data table: {e}")
+    except Exception as e:
+        print(f"Error opening {database_path}: {e}")
+    return participant_exported and data_exported
 
 
 
@@ -0,0 +1,89 @@
+import json
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from tmr_accumulator import RC_TRIAL_TYPE, load_latents
+
+
+ROOT = Path(__file__).parent
+DATA_PATH = ROOT / 'Data' / 'jspsych_data.csv'
+LATENTS_PATH = ROOT / 'Latents' / 'latents.npz'
+
+
+def save_trials(database_path, trials, chunk_size=None):
+    """Save trials the way the experiment server does.
+
+    Each worker gets a Participant row (if it has none yet) and Data rows
+    holding its trials as json_data, chunk_size trials per row (all of them
+    by default). Appends to an existing database.
+    """
+    conn = sqlite3.connect(database_path)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS Participant '
+        '(id INTEGER PRIMARY KEY, worker_id TEXT, anon_id TEXT, condition TEXT)'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS Data '
+        '(id INTEGER PRIMARY KEY, worker_id TEXT, condition TEXT, json_data TEXT)'
+    )
+    for worker_id, group in trials.groupby('worker_id', sort=False):
+        condition = group['condition'].iloc[0]
+        if conn.execute('SELECT 1 FROM Participant WHERE worker_id = ?', (worker_id,)).fetchone() is None:
+            conn.execute(
+                'INSERT INTO Participant (worker_id, anon_id, condition) VALUES (?, ?, ?)',
+                (worker_id, group['anon_id'].iloc[0], condition),
+            )
+        records = [
+            {key: value for key, value in record.items() if not pd.isna(value)}
+            for record in group.to_dict('records')
+        ]
+        step = chunk_size or len(records)
+        for start in range(0, len(records), step):
+            conn.execute(
+                'INSERT INTO Data (worker_id, condition, json_data) VALUES (?, ?, ?)',
+                (worker_id, condition, json.dumps(records[start:start + step])),
+            )
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture(scope='session')
+def write_database():
+    return save_trials
+
+
+@pytest.fixture(scope='session')
+def data_path():
+    return DATA_PATH
+
+
+@pytest.fixture(scope='session')
+def latents_path():
+    return LATENTS_PATH
+
+
+@pytest.fixture(scope='session')
+def jspsych_data():
+    """Every trial of the bundled export, with worker_id taken from anon_id.
+
+    Shared across tests, so copy before modifying.
+    """
+    data = pd.read_csv(DATA_PATH, low_memory=False, dtype={'anon_id': str})
+    data['worker_id'] = data['anon_id']
+    return data
+
+
+@pytest.fixture(scope='session')
+def rc_trials(jspsych_data):
+    """The reverse-correlation trials, with repeat as a bool."""
+    data = jspsych_data.loc[jspsych_data['trial_type'] == RC_TRIAL_TYPE].copy()
+    data['repeat'] = data['repeat'].astype(bool)
+    return data
+
+
+@pytest.fixture(scope='session')
+def latents():
+    return load_latents(LATENTS_PATH)
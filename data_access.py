@@ -0,0 +1,216 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+
+# Pragmas applied to every connection handed out by get_connection.
+# WAL lets the experiment server keep writing while we read, mmap/cache keep
+# repeated scans of the Data table off the disk. journal_mode writes to the
+# database file, so read-only databases skip it (and the indexes).
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 268435456,  # 256 MB
+    'cache_size': -65536,    # negative = KiB, so 64 MB
+    'temp_store': 'MEMORY',
+}
+
+INDEXES = {
+    'idx_data_worker_id': ('Data', 'worker_id'),
+    'idx_data_id': ('Data', 'id'),
+}
+
+PAGE_SIZE = 500
+
+_connections = {}
+
+
+def _quote(identifier):
+    return '"{}"'.format(str(identifier).replace('"', '""'))
+
+
+def _select_list(columns):
+    if not columns:
+        return '*'
+    return ', '.join(_quote(col) for col in columns)
+
+
+def _is_writable(path):
+    # WAL needs the -wal/-shm files next to the database as well
+    if not os.path.exists(path):
+        return True
+    directory = os.path.dirname(os.path.abspath(path))
+    return os.access(path, os.W_OK) and os.access(directory, os.W_OK)
+
+
+def _open_read_only(path):
+    conn = sqlite3.connect(f'{Path(path).resolve().as_uri()}?mode=ro', uri=True)
+    for name, value in PRAGMAS.items():
+        if name != 'journal_mode':
+            conn.execute(f'PRAGMA {name}={value}')
+    return conn
+
+
+def _open(path):
+    if not _is_writable(path):
+        return _open_read_only(path)
+    conn = sqlite3.connect(path)
+    try:
+        for name, value in PRAGMAS.items():
+            conn.execute(f'PRAGMA {name}={value}')
+        ensure_indexes(conn)
+    except sqlite3.OperationalError as e:
+        # e.g. a read-only mount that os.access doesn't report
+        if 'readonly' not in str(e):
+            raise
+        conn.close()
+        return _open_read_only(path)
+    return conn
+
+
+def get_connection(database_path='database.db'):
+    """Return the shared connection for database_path, opening it on first use.
+
+    Read-only databases are opened with mode=ro and without WAL or indexes.
+    """
+    key = str(database_path)
+    conn = _connections.get(key)
+    if conn is None:
+        conn = _open(key)
+        _connections[key] = conn
+    return conn
+
+
+def close_connection(database_path='database.db'):
+    conn = _connections.pop(str(database_path), None)
+    if conn is not None:
+        conn.close()
+
+
+@contextmanager
+def connection(database_path='database.db'):
+    """Shared connection for a block, closed afterwards only if this block opened it."""
+    opened = str(database_path) not in _connections
+    conn = get_connection(database_path)
+    try:
+        yield conn
+    finally:
+        if opened:
+            close_connection(database_path)
+
+
+def table_exists(conn, table):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def ensure_indexes(conn):
+    """Create the lookup indexes on Data(worker_id) and Data(id) if missing."""
+    for index_name, (table, column) in INDEXES.items():
+        if not table_exists(conn, table):
+            continue
+        conn.execute(
+            f'CREATE INDEX IF NOT EXISTS {_quote(index_name)} '
+            f'ON {_quote(table)} ({_quote(column)})'
+        )
+    conn.commit()
+
+
+def iter_table(conn, table, columns=None, page_size=PAGE_SIZE, after_rowid=0, keep_rowid=False):
+    """Yield a table as DataFrames of at most page_size rows.
+
+    Only the requested columns are selected. Pages are keyed on rowid so each
+    page is an index seek rather than an OFFSET scan; pass after_rowid to
+    read only rows added since an earlier read, and keep_rowid to get the
+    rowid back as a _rowid column.
+    """
+    select_list = _select_list(columns)
+    query = (
+        f'SELECT rowid AS _rowid, {select_list} FROM {_quote(table)} '
+        f'WHERE rowid > ? ORDER BY rowid LIMIT ?'
+    )
+    last_rowid = after_rowid
+    while True:
+        page = pd.read_sql_query(query, conn, params=(last_rowid, page_size))
+        if page.empty:
+            break
+        last_rowid = int(page['_rowid'].iloc[-1])
+        yield page if keep_rowid else page.drop(columns=['_rowid'])
+        if len(page) < page_size:
+            break
+
+
+def read_table(conn, table, columns=None, page_size=PAGE_SIZE):
+    pages = list(iter_table(conn, table, columns=columns, page_size=page_size))
+    if not pages:
+        return pd.read_sql_query(
+            f'SELECT {_select_list(columns)} FROM {_quote(table)} LIMIT 0', conn
+        )
+    return pd.concat(pages, ignore_index=True)
+
+
+def load_worker_ids(conn, worker_ids, table='passed_workers'):
+    """Replace the contents of a temporary worker_id table with worker_ids.
+
+    The fill is committed so the connection is not left in an open
+    transaction, which would pin it to a stale snapshot of the database.
+    """
+    with conn:
+        conn.execute(
+            f'CREATE TEMP TABLE IF NOT EXISTS {_quote(table)} (worker_id TEXT PRIMARY KEY)'
+        )
+        conn.execute(f'DELETE FROM {_quote(table)}')
+        conn.executemany(
+            f'INSERT OR IGNORE INTO {_quote(table)} (worker_id) VALUES (?)',
+            ((str(worker_id),) for worker_id in worker_ids)
+        )
+    return table
+
+
+def drop_worker_ids(conn, table='passed_workers'):
+    with conn:
+        conn.execute(f'DROP TABLE IF EXISTS temp.{_quote(table)}')
+
+
+def iter_data_for_workers(conn, worker_ids, columns=None, page_size=PAGE_SIZE):
+    """Yield Data rows belonging to worker_ids, joined through a temp table.
+
+    Workers are read in batches of page_size, each batch looked up through
+    idx_data_worker_id rather than scanning Data, so rows come out in rowid
+    order within a batch. The temp table is dropped once the read finishes.
+    """
+    worker_ids = sorted({str(worker_id) for worker_id in worker_ids})
+    worker_table = load_worker_ids(conn, worker_ids)
+    select_list = ', '.join(f'd.{_quote(col)}' for col in columns) if columns else 'd.*'
+    query = (
+        f'SELECT {select_list} FROM Data AS d '
+        f'WHERE d.worker_id IN (SELECT worker_id FROM {_quote(worker_table)} '
+        f'WHERE worker_id BETWEEN ? AND ?) ORDER BY d.rowid'
+    )
+    pages = None
+    try:
+        for start in range(0, len(worker_ids), page_size):
+            batch = worker_ids[start:start + page_size]
+            pages = pd.read_sql_query(query, conn, params=(batch[0], batch[-1]), chunksize=page_size)
+            for page in pages:
+                if not page.empty:
+                    yield page
+    finally:
+        # A half-read page iterator still holds a statement on the temp table
+        if pages is not None:
+            pages.close()
+        drop_worker_ids(conn, worker_table)
+
+
+def read_data_for_workers(conn, worker_ids, columns=None, page_size=PAGE_SIZE):
+    pages = list(iter_data_for_workers(conn, worker_ids, columns=columns, page_size=page_size))
+    if not pages:
+        return pd.read_sql_query(
+            f'SELECT {_select_list(columns)} FROM Data LIMIT 0', conn
+        )
+    return pd.concat(pages, ignore_index=True)
@@ -0,0 +1,862 @@
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+# Heavy imports (scipy, torch, pingouin, the modeling-tools code) happen inside the
+# functions that need them, so importing this module and the data stages stay quick.
+
+STAGES = ['load_data', 'clean_data', 'main_data', 'results', 'condition_averages', 'reels']
+
+# Options recorded in state.json, with the first stage whose output depends
+# on each; changing one reruns from that stage. *_file entries are the size
+# and mtime of the input, so replacing a file in place counts as a change.
+OPTION_STAGES = {
+    'data': 'load_data',
+    'data_file': 'load_data',
+    'exclude': 'clean_data',
+    'save_path': 'clean_data',
+    'latents': 'results',
+    'latents_file': 'results',
+    'seed': 'results',
+    'decode': 'results',
+    'ckpt': 'results',
+    'model_path': 'results',
+    'min_sd': 'results',
+    'max_sd': 'results',
+    'step': 'results',
+}
+
+SEED = 628884
+IDS_TO_EXCLUDE = ["XXX", "95165"]
+NEITHER_LABEL = "not sure"
+
+
+def clean_column_names(df):
+    """Snake-case column names, as janitor's clean_names(case_type="snake") does for ours."""
+    def snake(name):
+        name = re.sub(r'(.)([A-Z][a-z]+)', r'\1_\2', str(name))
+        name = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', name).lower()
+        name = re.sub(r"[ /:,?()\.-]", '_', name).replace("'", '')
+        return re.sub(r'_+', '_', name).strip('_')
+
+    return df.rename(columns=snake)
+
+
+def get_condition_specific_labels(condition):
+    """Returns response labels dynamically based on condition."""
+    condition = condition.upper()  # Ensure "gad" -> "GAD"
+    return {
+        "positive": condition,           # e.g., "GAD"
+        "negative": f"no {condition}",   # e.g., "no GAD"
+        "neither": NEITHER_LABEL
+    }
+
+
+# ---------------------------------------------------------------------------
+# Data loading and screening (analysis.ipynb imports these)
+# ---------------------------------------------------------------------------
+
+def load_data(data_path):
+    data = clean_column_names(pd.read_csv(data_path, low_memory=False))
+    data["worker_id"] = data["worker_id"].fillna(data["sona_id"])
+    return data
+
+
+def load_rc_latents(path):
+    return np.load(path)["data"]
+
+
+def clean_data(data, ids_to_exclude=IDS_TO_EXCLUDE):
+    for this_id in ids_to_exclude:
+        if this_id:
+            data = data.loc[~data["worker_id"].str.contains(this_id, case=False, na=False, regex=False)]
+    return data
+
+
+def calculate_reliability(df, expected_pairs=30):
+    """Test-retest Pearson correlation per worker from repeated stimuli.
+
+    Returns np.nan for workers with fewer than two valid pairs or for whom
+    the correlation can't be calculated.
+    """
+    from scipy.stats import pearsonr
+
+    rc_data = df[df['trial_type'] == 'single-stim-rev-cor-trial'].copy()
+    rc_data['repeat'] = rc_data['repeat'].replace(
+        {'True': True, 'False': False, 'true': True, 'false': False}
+    ).astype(bool)
+
+    response_map = {
+        "GAD": 1, "no GAD": -1,
+        "MDD": 1, "no MDD": -1,
+        "PTSD": 1, "no PTSD": -1,
+        "BPD": 1, "no BPD": -1,
+        "yes": 1, "no": -1, "not sure": 0
+    }
+    rc_data['score'] = rc_data['response_label'].map(response_map)
+    rc_data = rc_data.dropna(subset=['score'])
+
+    reliability_scores = {}
+    for worker_id, worker_data in rc_data.groupby('worker_id'):
+        stimulus_counts = worker_data['stimulus_number'].value_counts()
+        paired_stimuli = stimulus_counts[stimulus_counts == 2].index
+
+        valid_pairs = []
+        for stim in paired_stimuli:
+            stim_data = worker_data[worker_data['stimulus_number'] == stim]
+            first = stim_data[~stim_data['repeat']]
+            repeat = stim_data[stim_data['repeat']]
+            if len(first) == 1 and len(repeat) == 1:
+                valid_pairs.append((first.iloc[0]['score'], repeat.iloc[0]['score']))
+
+        reliability_scores[worker_id] = np.nan
+        if len(valid_pairs) >= 2:
+            try:
+                first_resp, repeat_resp = zip(*valid_pairs)
+                corr = pearsonr(first_resp, repeat_resp)[0]
+                if len(valid_pairs) != expected_pairs:
+                    print(f"Warning: {worker_id} has {len(valid_pairs)} pairs (expected {expected_pairs})")
+                reliability_scores[worker_id] = corr
+            except Exception:
+                pass
+
+    return pd.Series(reliability_scores, name='pearson_r')
+
+
+def get_main_data(data, include_repeat_data=True):
+    """Main-phase trials from each participant's first session, with stimulus indexes."""
+    main_data = data.loc[data["experiment_phase"].isin(["main", "main_repeat"])].copy()
+    if main_data.empty:
+        print("Warning: No data found for experiment_phase == 'main'.")
+        return pd.DataFrame()
+
+    try:
+        main_data["start_time"] = pd.to_datetime(main_data["start_time"])
+        main_data["end_time"] = pd.to_datetime(main_data["end_time"])
+    except Exception as e:
+        print(f"Warning: Could not convert time columns: {e}")
+
+    # Get first session per worker
+    if "start_time" in main_data.columns and "anon_id" in main_data.columns:
+        min_start_times = main_data.groupby("anon_id")["start_time"].transform("min")
+        main_data = main_data.loc[main_data["start_time"] == min_start_times]
+
+    if not include_repeat_data:
+        main_data = main_data.loc[~main_data["repeat"].astype(bool)]
+
+    if "stimulus" in main_data.columns:
+        main_data["stimulus"] = main_data["stimulus"].str.replace("src/images/main/", "", regex=False)
+        main_data["latent"] = main_data["stimulus"].str.replace(".jpg", ".npy", regex=False)
+        main_data["stimulus_index"] = pd.to_numeric(
+            main_data["stimulus"].str.replace(".jpg", "", regex=False),
+            errors="coerce"
+        )
+
+    return main_data
+
+
+def get_simplified_race(races):
+    if len(races) == 1:
+        return races[0]
+    return "Two or more races"
+
+
+def get_meta_data(
+    data,
+    survey_types=["demographic_survey", "debriefing_survey"],
+    worker_id_col="worker_id",
+    expected_repeat_pairs=30,
+    reliability_must_be_above=0,
+    seriousness_threshold=70,
+    min_pixel_count=480_000,
+):
+    """One row per participant with survey answers, response counts and exclusion flags."""
+    id_columns = ['anon_id', 'worker_id', 'sona_id']
+    available_ids = [col for col in id_columns if col in data.columns]
+    if not available_ids:
+        raise ValueError("No valid ID columns found in data")
+    primary_id = available_ids[0]
+
+    main_data = data.loc[data["experiment_phase"].isin(["main", "main_repeat"])].copy()
+
+    if "start_time" in main_data.columns:
+        if not pd.api.types.is_datetime64_any_dtype(main_data["start_time"]):
+            main_data["start_time"] = pd.to_datetime(main_data["start_time"], format='ISO8601')
+        min_start_times = main_data.groupby(primary_id)["start_time"].transform("min")
+        df_first_session = main_data.loc[main_data["start_time"] == min_start_times].copy()
+    else:
+        print("No start_time")
+        df_first_session = main_data
+
+    reliability_scores = calculate_reliability(df_first_session, expected_pairs=expected_repeat_pairs)
+
+    response_counts_by_subject = main_data.groupby(by=primary_id)["response_label"].value_counts()
+    reaction_times = main_data.groupby(by=[primary_id, "response_label"])["rt"]
+    reaction_times_by_subject_and_response = reaction_times.mean()
+    reaction_times_by_subject_and_response_stds = reaction_times.std()
+
+    id_to_condition = main_data.groupby(by=primary_id)["condition"].first()
+    screen_dimensions = data.groupby(primary_id)[["screen_width", "screen_height"]].first()
+
+    rows = []
+    for subject_id, group in data.groupby(by=primary_id):
+        survey_dataframes = []
+        for survey_type in survey_types:
+            survey_data = (
+                group.loc[group["experiment_phase"] == survey_type]
+                .dropna(subset=["form_data"])
+                .loc[:, [primary_id, "form_data"]]
+            )
+            if survey_data.empty:
+                continue
+            try:
+                survey_df = pd.concat(
+                    [pd.DataFrame([json.loads(form_data)]) for form_data in survey_data["form_data"]]
+                )
+                survey_dataframes.append(survey_df)
+            except Exception as e:
+                print(f"Error processing survey data for {primary_id} {subject_id}, survey {survey_type}: {e}")
+
+        row = {
+            primary_id: subject_id,
+            "condition": id_to_condition.get(subject_id, None),
+            **{col: group[col].iloc[0] for col in id_columns if col in group.columns}
+        }
+
+        response_counts = response_counts_by_subject.get(subject_id, {})
+        for resp in ["yes", "no", "not sure"]:
+            row[f"{resp}_count"] = response_counts.get(resp, 0)
+            row[f"{resp}_rt_mean"] = reaction_times_by_subject_and_response.get((subject_id, resp), np.nan)
+            row[f"{resp}_rt_sd"] = reaction_times_by_subject_and_response_stds.get((subject_id, resp), np.nan)
+
+        if survey_dataframes:
+            combined_data = pd.concat(survey_dataframes, axis=1)
+            collapsed_data = combined_data.apply(
+                lambda x: x.dropna().iloc[0] if not x.dropna().empty else None)
+            row.update(collapsed_data.to_dict())
+
+        if subject_id in screen_dimensions.index:
+            width = screen_dimensions.loc[subject_id, "screen_width"]
+            height = screen_dimensions.loc[subject_id, "screen_height"]
+            row.update({"screen_width": width, "screen_height": height, "screen_area": width * height})
+
+        if subject_id in reliability_scores.index:
+            row["reliability_score"] = reliability_scores.loc[subject_id]
+
+        exclusion_flags = {
+            "seriousness_low": "seriousness" in row and
+                               pd.to_numeric(row["seriousness"], errors="coerce") < seriousness_threshold,
+            "screen_size_low": "screen_area" in row and row["screen_area"] < min_pixel_count,
+            "interrupted_survey": "interruption" in row and bool(row["interruption"])
+                                  and "yes" in str(row["interruption"]).lower(),
+            "previously_participated": "participatedBefore" in row and bool(row["participatedBefore"])
+                                       and "yes" in str(row["participatedBefore"]).lower(),
+            "reliability_low": "reliability_score" in row and
+                               (row["reliability_score"] <= reliability_must_be_above or
+                                np.isnan(row["reliability_score"]))
+        }
+        row.update(exclusion_flags)
+        row["is_bad_subject"] = any(exclusion_flags.values())
+        rows.append(row)
+
+    meta_data = clean_column_names(pd.DataFrame.from_records(rows))
+    if "race" in meta_data.columns:
+        meta_data["simplified_race"] = meta_data["race"].apply(get_simplified_race)
+    return meta_data
+
+
+# ---------------------------------------------------------------------------
+# Per-subject TMRs
+# ---------------------------------------------------------------------------
+
+def get_category_latents(subject_data, category, latents,
+                         category_col="response_label", latent_col="stimulus_index"):
+    indexes = subject_data.loc[subject_data[category_col] == category][latent_col].astype(int).tolist()
+    return latents[indexes, :]
+
+
+def get_subject_means(
+    subject_data,
+    latents,
+    positive_category="yes",
+    negative_category="no",
+    neither_category=NEITHER_LABEL,
+    desired_num_trials=5,
+    num_response_options=3,
+    num_random_latents=30,
+    seed=SEED,
+):
+    """Category latents and means for one subject (the numpy half of get_results).
+
+    A missing or sparse "not sure" category is filled with random stimuli.
+    """
+    random.seed(seed)
+    subject_id = subject_data["anon_id"].unique()[0]
+
+    conditions = subject_data["condition"].unique()
+    if len(conditions) != 1:
+        raise ValueError("There should be exactly one condition per subject!")
+
+    response_label_dict = subject_data.groupby("response_label").size()
+    if response_label_dict.sum() < desired_num_trials:
+        raise ValueError(f"Less than {desired_num_trials} trials!")
+
+    has_no_neither = neither_category not in response_label_dict.keys()
+    if response_label_dict.shape[0] < num_response_options and not has_no_neither:
+        raise ValueError(
+            f"Need at least one response per (unreplaceable) option! Subject: {subject_id}"
+        )
+
+    possible_latent_indexes = subject_data["stimulus_index"].astype(int).unique().tolist()
+    if has_no_neither:
+        print(f"Replacing '{neither_category}' with random average...")
+        neither_latent_indexes = random.sample(possible_latent_indexes, num_random_latents)
+        neither_latents = latents[neither_latent_indexes, :]
+    else:
+        neither_latents = get_category_latents(subject_data, category=neither_category, latents=latents)
+        if 1 <= neither_latents.shape[0] < num_random_latents:
+            print(
+                f"{subject_id}: only {neither_latents.shape[0]} responses in '{neither_category}' "
+                f"category; adding more to reach {num_random_latents}..."
+            )
+            neither_latent_indexes = subject_data.loc[
+                subject_data["response_label"] == neither_category
+            ]["stimulus_index"].astype(int).tolist()
+            remaining_possible_indexes = set(possible_latent_indexes) - set(neither_latent_indexes)
+            additional_neither_latent_indexes = random.sample(
+                list(remaining_possible_indexes),
+                num_random_latents - len(neither_latent_indexes),
+            )
+            neither_latents = latents[[*neither_latent_indexes, *additional_neither_latent_indexes], :]
+
+    positive_latents = get_category_latents(subject_data, category=positive_category, latents=latents)
+    negative_latents = get_category_latents(subject_data, category=negative_category, latents=latents)
+    all_latents = [*positive_latents, *negative_latents, *neither_latents]
+    print(f"Positive latents: {len(positive_latents)}")
+    print(f"Negative latents: {len(negative_latents)}")
+    print(f"Neither latents: {len(neither_latents)}")
+
+    positive_mean = np.mean(positive_latents, axis=0)
+    negative_mean = np.mean(negative_latents, axis=0)
+    neither_mean = np.mean(neither_latents, axis=0)
+    return {
+        "condition": conditions[0],
+        "positive": positive_latents,
+        "negative": negative_latents,
+        "neither": neither_latents,
+        "positive_mean": positive_mean,
+        "negative_mean": negative_mean,
+        "neither_mean": neither_mean,
+        "tmr_vector": positive_mean - negative_mean,  # just the direction
+        "all": all_latents,
+    }
+
+
+def get_concat_h_multi_resize(im_list, resample=None):
+    from PIL import Image
+
+    if resample is None:
+        resample = Image.BICUBIC
+    min_height = min(im.height for im in im_list)
+    im_list_resize = [
+        im.resize((int(im.width * min_height / im.height), min_height), resample=resample)
+        for im in im_list
+    ]
+    dst = Image.new("RGB", (sum(im.width for im in im_list_resize), min_height))
+    pos_x = 0
+    for im in im_list_resize:
+        dst.paste(im, (pos_x, 0))
+        pos_x += im.width
+    return dst
+
+
+# ---------------------------------------------------------------------------
+# Decoding (needs torch and the modeling-tools repo on sys.path)
+# ---------------------------------------------------------------------------
+
+class Models:
+    """Generator/decoder and attribute model, loaded on first use."""
+
+    def __init__(self, modeling_tools_dir, ckpt, model_path):
+        self.modeling_tools_dir = Path(modeling_tools_dir)
+        self.ckpt = ckpt
+        self.model_path = model_path
+        self._loaded = None
+
+    def load(self):
+        if self._loaded is None:
+            started = time.time()
+            sys.path.append(str(self.modeling_tools_dir))
+            from Generators import StyleGAN2
+            from Projectors import BaseProjector
+            from Config import BaseGeneratorOpts, BaseProjectorOpts
+            from EncoderDecoder import EncoderDecoder
+            from Models import MultiAttributeModel
+
+            base_generator = StyleGAN2(BaseGeneratorOpts(ckpt=self.ckpt))
+            base_projector = BaseProjector(
+                generator=base_generator.generator,
+                projector_opts=BaseProjectorOpts(ckpt=self.ckpt, step=1000),
+            )
+            model = MultiAttributeModel()
+            model.load(self.model_path)
+            self._loaded = {
+                "ed": EncoderDecoder(generator=base_generator, projector=base_projector),
+                "model": model,
+            }
+            print(f"Loaded decoder and attribute model in {time.time() - started:.1f}s")
+        return self._loaded
+
+
+def create_mental_representations(
+    encoder_decoder,
+    positive,
+    negative,
+    neutral,
+    step_num,
+    norm=True,
+    mixed_norm=False,
+    eps=1e-8,
+    idio=False
+):
+    """
+    Create mental representations based on the given vectors.
+
+    Args:
+        encoder_decoder: The encoder-decoder model.
+        positive: A vector that represents the high end of the scale (or target judgment).
+        negative: A vector that represents the low end of the scale (or anti-target judgment).
+        neutral: A vector that the unique values are applied (either mean of selected "neutrals" or mean of a random selection).
+        step_num: An integer to multiply the vector values by (if normlized with `norm=True`, this can be interpreted as +/-SDs).
+        norm: A boolean indicating whether to normalize the vectors (default: True).
+        mixed_norm: A boolean indicating whether to use mixed normalization whereby the "neutral" vector is left unnormalized (default: False).
+        eps: A small value to prevent division by zero (default: 1e-8).
+        idio: A boolean indicating whether to return the idiosyncratic model vector (default: False).
+
+    Returns:
+        A dict with the output image, the decoded latents, and the positive-negative vector (if idio=True).
+    """
+    import torch
+    from utils.common import tensor2im
+
+    if norm:
+        # Get neutral magnitude for later unnormalization
+        neutral_magnitude = np.linalg.norm(neutral)
+
+        # Normalize both vectors
+        pos_neg = positive - negative
+        normalized_diff = pos_neg / (np.linalg.norm(pos_neg) + eps)
+        normalized_neutral = neutral / (np.linalg.norm(neutral) + eps)
+
+        # Combine normalized vectors
+        pos_neg_out = (normalized_neutral + step_num * normalized_diff) * neutral_magnitude
+
+    elif mixed_norm:
+        # Normalize only the difference vector
+        pos_neg = positive - negative
+        normalized_diff = pos_neg / (np.linalg.norm(pos_neg) + eps)
+        pos_neg_out = (step_num * normalized_diff) + neutral
+
+    else:
+        pos_neg = positive - negative
+        pos_neg_out = (pos_neg * step_num) + neutral
+
+    to_decode = torch.from_numpy(pos_neg_out).cuda().float()
+    with torch.no_grad():
+        out = encoder_decoder.decode(to_decode)
+
+    result = {
+        "image": tensor2im(out.squeeze()),
+        "latents": to_decode.cpu().detach().numpy(),
+    }
+    if idio:
+        result["idio"] = pos_neg
+    return result
+
+
+def sd_steps(min_sd, max_sd, step):
+    return np.arange(min_sd, max_sd + step, step)
+
+
+def decode_subject(encoder_decoder, model, means, subject_id, save_path,
+                   min_sd=-1.5, max_sd=1.5, step=0.5, save_output=True):
+    """Render a subject's reel and correlate the TMR with the attribute model (the torch half of get_results)."""
+    import pingouin as pg
+
+    condition = means["condition"]
+    subject_save_path = Path(save_path) / condition / subject_id
+    reel_save_path = Path(save_path) / condition / "reels"
+    if save_output:
+        subject_save_path.mkdir(parents=True, exist_ok=True)
+        reel_save_path.mkdir(parents=True, exist_ok=True)
+
+    images = []
+    our_model_analyses = []
+    for s in sd_steps(min_sd, max_sd, step):
+        result = create_mental_representations(
+            encoder_decoder, means["positive_mean"], means["negative_mean"], means["neither_mean"], s
+        )
+        images.append(result["image"])
+        our_model_analyses.append(model.predict_all(result["latents"]))
+        if save_output:
+            result["image"].save(subject_save_path / f"{subject_id}_{condition}_{s}.jpg")
+            np.save(subject_save_path / f"{subject_id}_{condition}_{s}.npy", result["latents"])
+
+    reel = get_concat_h_multi_resize(images)
+    if save_output:
+        reel.save(reel_save_path / f"{subject_id}_{condition}_reel.jpg")
+
+    model_correlations = {}
+    for attribute in model.factors.keys():
+        vector = model.get_factor(attribute)["coefficients"]
+        this_corr = pg.corr(vector, means["tmr_vector"]).to_dict("records")[0]
+        for key, value in this_corr.items():
+            name = {"r": "tmr_r", "p-val": "tmr_r_pval"}.get(key, f"tmr_r_{key}")
+            model_correlations[f"{name}_{attribute}"] = value
+
+    return {
+        "our_model_analyses": our_model_analyses,
+        **{f"negative_{key}": value for key, value in our_model_analyses[0].items()},
+        **{f"positive_{key}": value for key, value in our_model_analyses[-1].items()},
+        **model_correlations,
+    }
+
+
+def get_results(
+    subject_data,
+    latents,
+    positive_category="yes",
+    negative_category="no",
+    neither_category=NEITHER_LABEL,
+    desired_num_trials=5,
+    num_response_options=3,
+    num_random_latents=30,
+    min_sd=-1.5,
+    max_sd=1.5,
+    step=0.5,
+    save_path="output/results",
+    save_output=False,
+    seed=SEED,
+    encoder_decoder=None,
+    model=None,
+):
+    """Means, TMR, reel and attribute-model correlations for one subject.
+
+    Too few trials or responses raise ValueError; decoding errors are
+    printed and give None.
+    """
+    means = get_subject_means(
+        subject_data,
+        latents,
+        positive_category=positive_category,
+        negative_category=negative_category,
+        neither_category=neither_category,
+        desired_num_trials=desired_num_trials,
+        num_response_options=num_response_options,
+        num_random_latents=num_random_latents,
+        seed=seed,
+    )
+    subject_id = subject_data["anon_id"].unique()[0]
+    try:
+        return {
+            **means,
+            **decode_subject(
+                encoder_decoder, model, means, subject_id, save_path,
+                min_sd=min_sd, max_sd=max_sd, step=step, save_output=save_output,
+            ),
+        }
+    except Exception as e:
+        print(f"error in subject: {subject_id}: {e}")
+
+
+def create_mental_representation_reel(mean_dict, decoder, min_sd=-2, max_sd=2, step=0.5):
+    images = []
+    result_latents = []
+    for s in sd_steps(min_sd, max_sd, step):
+        result = create_mental_representations(
+            encoder_decoder=decoder,
+            positive=mean_dict["positive"],
+            negative=mean_dict["negative"],
+            neutral=mean_dict["neither"],
+            step_num=s,
+            norm=True,
+        )
+        images.append(result["image"])
+        result_latents.append(result["latents"])
+
+    return {
+        "images": images,
+        "latents": result_latents,
+        "reel": get_concat_h_multi_resize(images),
+    }
+
+
+def save_average_face_reels(df, decoder, save_path, group_columns=("condition",),
+                            min_sd=-2, max_sd=2, step=0.5):
+    """Save a reel and per-step faces for each row of group means, named by group_columns."""
+    average_save_path = Path(save_path) / "averages"
+    average_save_path.mkdir(parents=True, exist_ok=True)
+
+    for row in df.to_dict("records"):
+        name = "-".join(str(row[col]) for col in group_columns)
+        reel = create_mental_representation_reel(
+            mean_dict={
+                "positive": row["positive_mean"],
+                "negative": row["negative_mean"],
+                "neither": row["neither_mean"],
+            },
+            decoder=decoder,
+            min_sd=min_sd,
+            max_sd=max_sd,
+            step=step,
+        )
+        reel["reel"].save(average_save_path / f"{name}.png")
+        for s, img in zip(sd_steps(min_sd, max_sd, step), reel["images"]):
+            img.save(average_save_path / f"{name}_{s}.png")
+
+
+# ---------------------------------------------------------------------------
+# Checkpointed stages
+# ---------------------------------------------------------------------------
+
+def file_fingerprint(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Checkpoints:
+    """Pickled stage outputs plus a state.json recording which stages finished."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.state_path = self.root / "state.json"
+        self.state = json.loads(self.state_path.read_text()) if self.state_path.exists() else {}
+
+    def _write_state(self):
+        tmp_path = self.state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.state, indent=2))
+        os.replace(tmp_path, self.state_path)
+
+    def is_done(self, stage):
+        return stage in self.state
+
+    def mark_done(self, stage):
+        self.state[stage] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self._write_state()
+
+    def invalidate_from(self, stage, clear_subject_results=False):
+        for later in STAGES[STAGES.index(stage):]:
+            self.state.pop(later, None)
+        self._write_state()
+        # Subject results computed from older main data are stale too
+        if clear_subject_results or STAGES.index(stage) < STAGES.index("results"):
+            for path in (self.root / "results").glob("*.pkl"):
+                path.unlink()
+
+    def set_options(self, options):
+        self.state["options"] = options
+        self._write_state()
+
+    def save(self, name, obj):
+        path = self.root / f"{name}.pkl"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        pd.to_pickle(obj, tmp_path)
+        os.replace(tmp_path, path)
+
+    def load(self, name):
+        return pd.read_pickle(self.root / f"{name}.pkl")
+
+    def has(self, name):
+        return (self.root / f"{name}.pkl").exists()
+
+
+class Pipeline:
+    def __init__(self, args):
+        self.args = args
+        self.checkpoints = Checkpoints(args.checkpoint_dir)
+        self.save_path = Path(args.save_path)
+        self.models = Models(args.modeling_tools_dir, args.ckpt, args.model_path)
+
+    def stage_load_data(self):
+        self.checkpoints.save("data", load_data(self.args.data))
+
+    def stage_clean_data(self):
+        data = clean_data(self.checkpoints.load("data"), ids_to_exclude=self.args.exclude)
+        print(f"Participants after exclusion: {data['worker_id'].nunique()}")
+        meta_data = get_meta_data(data)
+        self.save_path.mkdir(parents=True, exist_ok=True)
+        meta_data.to_csv(self.save_path / "subject_meta_data.csv", index=False)
+        self.checkpoints.save("clean_data", data)
+        self.checkpoints.save("meta_data", meta_data)
+
+    def stage_main_data(self):
+        meta_data = self.checkpoints.load("meta_data")
+        good_subject_ids = meta_data.loc[~meta_data["is_bad_subject"]]["anon_id"].tolist()
+        main_data = get_main_data(self.checkpoints.load("clean_data"), include_repeat_data=True)
+        main_data = main_data.loc[main_data["anon_id"].isin(good_subject_ids)]
+        main_data = main_data.loc[main_data["experiment_phase"] == "main"]
+        print(f"Main data: {main_data['anon_id'].nunique()} subjects, {len(main_data)} trials")
+        self.checkpoints.save("main_data", main_data)
+
+    def stage_results(self):
+        main_data = self.checkpoints.load("main_data")
+        latents = load_rc_latents(self.args.latents)
+        results = {}
+        errors = []
+
+        for anon_id, group in main_data.groupby("anon_id"):
+            # One checkpoint per subject, so a crash only loses the subject in progress
+            checkpoint_name = f"results/{anon_id}"
+            if self.checkpoints.has(checkpoint_name):
+                results[anon_id] = self.checkpoints.load(checkpoint_name)
+                continue
+
+            print(f"subject = {anon_id}")
+            labels = get_condition_specific_labels(group["condition"].iloc[0])
+            try:
+                result = get_subject_means(
+                    group,
+                    latents,
+                    positive_category=labels["positive"],
+                    negative_category=labels["negative"],
+                    neither_category=labels["neither"],
+                    seed=self.args.seed,
+                )
+                if self.args.decode:
+                    loaded = self.models.load()
+                    result.update(decode_subject(
+                        loaded["ed"], loaded["model"], result, anon_id, self.save_path,
+                        min_sd=self.args.min_sd, max_sd=self.args.max_sd, step=self.args.step,
+                    ))
+            except Exception as e:
+                errors.append(anon_id)
+                print(f"Error processing {anon_id}: {e}")
+                continue
+
+            self.checkpoints.save(checkpoint_name, result)
+            results[anon_id] = result
+
+        if errors:
+            print(f"{len(errors)} subjects failed; rerun with --from-stage results to retry them: {errors}")
+        if not results:
+            raise RuntimeError("No subject produced results")
+
+        df = pd.DataFrame.from_dict(results, orient="index").reset_index(names="anon_id")
+        dataset = pd.merge(df, self.checkpoints.load("meta_data"), on="anon_id", how="left",
+                           suffixes=("", "_meta"))
+        self.checkpoints.save("results", df)
+        self.checkpoints.save("dataset", dataset)
+
+    def stage_condition_averages(self):
+        dataset = self.checkpoints.load("dataset")
+        rows = []
+        for condition, group in dataset.groupby(by="condition"):
+            print(f"{condition=}, {group.shape[0]} participants")
+            rows.append({
+                "condition": condition,
+                "positive_mean": np.mean(np.stack(group["positive_mean"].to_numpy()), axis=0),
+                "negative_mean": np.mean(np.stack(group["negative_mean"].to_numpy()), axis=0),
+                "neither_mean": np.mean(np.stack(group["neither_mean"].to_numpy()), axis=0),
+            })
+        self.checkpoints.save("condition_averages", pd.DataFrame(rows))
+
+    def stage_reels(self):
+        if not self.args.decode:
+            print("Skipping reels (--no-decode)")
+            return False
+        save_average_face_reels(
+            self.checkpoints.load("condition_averages"),
+            decoder=self.models.load()["ed"],
+            save_path=self.save_path,
+            min_sd=self.args.min_sd,
+            max_sd=self.args.max_sd,
+            step=self.args.step,
+        )
+
+    def options(self):
+        args = self.args
+        return {
+            "data": str(args.data),
+            "data_file": file_fingerprint(args.data),
+            "exclude": list(args.exclude),
+            "save_path": str(args.save_path),
+            "latents": str(args.latents),
+            "latents_file": file_fingerprint(args.latents),
+            "seed": args.seed,
+            # Results checkpointed with --no-decode have no images or model correlations
+            "decode": args.decode,
+            "ckpt": str(args.ckpt),
+            "model_path": str(args.model_path),
+            "min_sd": args.min_sd,
+            "max_sd": args.max_sd,
+            "step": args.step,
+        }
+
+    def run(self, from_stage=None, until_stage=None):
+        if from_stage is not None:
+            self.checkpoints.invalidate_from(from_stage)
+        previous = self.checkpoints.state.get("options", {})
+        options = self.options()
+        changed = [name for name, value in options.items() if name in previous and previous[name] != value]
+        if changed:
+            first_stage = min((OPTION_STAGES[name] for name in changed), key=STAGES.index)
+            print(f"Changed {', '.join(changed)}; recomputing from the {first_stage} stage")
+            self.checkpoints.invalidate_from(first_stage, clear_subject_results=True)
+        self.checkpoints.set_options(options)
+        last = STAGES.index(until_stage) if until_stage else len(STAGES) - 1
+
+        for stage in STAGES[:last + 1]:
+            if self.checkpoints.is_done(stage):
+                print(f"✓ {stage} (checkpoint)")
+                continue
+            print(f"Running {stage}...")
+            started = time.time()
+            if getattr(self, f"stage_{stage}")() is False:
+                continue
+            self.checkpoints.mark_done(stage)
+            print(f"✓ {stage} finished in {time.time() - started:.1f}s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run the analysis.ipynb pipeline headlessly, resuming from stage checkpoints.'
+    )
+    parser.add_argument('--data', default='Data/jspsych_data.csv', help='jsPsych trial CSV')
+    parser.add_argument('--latents', default='Latents/latents.npz')
+    parser.add_argument('--save-path', default='output/results', help='where images and tables are written')
+    parser.add_argument('--checkpoint-dir', default='output/checkpoints')
+    parser.add_argument('--from-stage', choices=STAGES, help='rerun from this stage even if checkpointed')
+    parser.add_argument('--until-stage', choices=STAGES, help='stop after this stage')
+    parser.add_argument('--exclude', nargs='*', default=IDS_TO_EXCLUDE, help='worker ids to exclude')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--no-decode', dest='decode', action='store_false',
+                        help='compute TMRs without rendering faces (no torch/GPU needed)')
+    parser.add_argument('--modeling-tools-dir', default='../repos/modeling-tools/')
+    parser.add_argument('--ckpt', default='../repos/modeling-tools/pretrained/NAMFHQ-config-f-004000.pt')
+    parser.add_argument('--model-path', default='../repos/modeling-tools/models/2024-01-29_omnibus_model.p')
+    parser.add_argument('--min-sd', type=float, default=-1.5)
+    parser.add_argument('--max-sd', type=float, default=1.5)
+    parser.add_argument('--step', type=float, default=0.5)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    Pipeline(args).run(from_stage=args.from_stage, until_stage=args.until_stage)
+
+
+if __name__ == "__main__":
+    main()
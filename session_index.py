@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+
+
+# Trial fields the index needs, in addition to whatever else is expanded
+KEY_FIELDS = ['anon_id', 'start_time', 'stimulus_number', 'repeat']
+
+
+def _is_missing(value):
+    return value is None or (not isinstance(value, str) and pd.isna(value))
+
+
+def hash_key(*parts):
+    """Hash of a trial key, so the index stays small.
+
+    Missing parts all hash as None (every NaN hashes differently). String
+    hashes change between processes, so the keys must not be saved.
+    """
+    return hash(tuple(None if _is_missing(part) else part for part in parts))
+
+
+def _normalize_repeat(value):
+    if isinstance(value, str):
+        return value.strip().lower() == 'true'
+    return bool(value) and not pd.isna(value)
+
+
+def _normalize_stimulus(value):
+    # json_data keeps numbers as strings while CSV loads give floats
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return value
+
+
+class SessionIndex:
+    """Duplicate-trial and session index built in one pass over the trials.
+
+    Each trial with a stimulus is keyed on (worker_id, session, start_time,
+    stimulus_number, repeat); a key seen before marks a duplicate trial.
+    Sessions are keyed on session_col (anon_id by default) and their
+    start_time, which gives each session id's first session, repeated
+    sessions, and retry submissions (the same session saved in more than
+    one Data row).
+    """
+
+    def __init__(self, session_col='anon_id', start_col='start_time'):
+        self.session_col = session_col
+        self.start_col = start_col
+        self.trial_keys = set()
+        self.duplicate_flags = []
+        self.first_start = {}
+        self.session_starts = {}
+        self.session_workers = {}
+        self.session_rows = {}
+        self._parsed_starts = {}
+
+    def _parse_start(self, value):
+        if _is_missing(value):
+            return pd.NaT
+        if isinstance(value, pd.Timestamp):
+            return value
+        parsed = self._parsed_starts.get(value)
+        if parsed is None:
+            parsed = pd.to_datetime(value, errors='coerce')
+            self._parsed_starts[value] = parsed
+        return parsed
+
+    def add(self, trial):
+        """Index one trial dict. Returns True if it duplicates an earlier trial."""
+        worker_id = trial.get('worker_id')
+        session = trial.get(self.session_col)
+        start = trial.get(self.start_col)
+        stimulus = trial.get('stimulus_number')
+
+        if not _is_missing(session):
+            parsed = self._parse_start(start)
+            if not pd.isna(parsed):
+                self.session_starts.setdefault(session, set()).add(parsed)
+                first = self.first_start.get(session)
+                if first is None or parsed < first:
+                    self.first_start[session] = parsed
+            if not _is_missing(worker_id):
+                self.session_workers.setdefault(session, set()).add(worker_id)
+            database_id = trial.get('database_id')
+            if not _is_missing(database_id):
+                self.session_rows.setdefault((session, str(start)), set()).add(database_id)
+
+        is_duplicate = False
+        if not _is_missing(stimulus):
+            key = hash_key(
+                worker_id, session, start,
+                _normalize_stimulus(stimulus), _normalize_repeat(trial.get('repeat')),
+            )
+            is_duplicate = key in self.trial_keys
+            self.trial_keys.add(key)
+
+        self.duplicate_flags.append(is_duplicate)
+        return is_duplicate
+
+    @classmethod
+    def from_frame(cls, df, session_col='anon_id', start_col='start_time'):
+        """Build an index from an already expanded DataFrame, in row order.
+
+        This adds the rows one at a time; when only the first-session rows are
+        needed, compare start_time with groupby(...).transform('min') instead.
+        """
+        index = cls(session_col=session_col, start_col=start_col)
+        columns = [col for col in ['worker_id', 'database_id', session_col, start_col,
+                                   'stimulus_number', 'repeat'] if col in df.columns]
+        for values in zip(*(df[col].tolist() for col in columns)):
+            index.add(dict(zip(columns, values)))
+        return index
+
+    def first_session_mask(self, df):
+        """Boolean mask of rows belonging to their session id's first session."""
+        starts = df[self.start_col]
+        if not pd.api.types.is_datetime64_any_dtype(starts):
+            starts = starts.map(self._parse_start)
+        first = df[self.session_col].map(self.first_start)
+        return (starts == first).fillna(False).astype(bool)
+
+    def duplicate_mask(self, df=None):
+        """Duplicate flags for the trials added so far, aligned with df if given."""
+        flags = np.array(self.duplicate_flags, dtype=bool)
+        if df is None:
+            return flags
+        return pd.Series(flags, index=df.index, name='duplicate_trial')
+
+    def annotate(self, df):
+        """Return df with duplicate_trial and first_session columns added."""
+        df = df.copy()
+        df['duplicate_trial'] = self.duplicate_mask(df)
+        df['first_session'] = self.first_session_mask(df)
+        return df
+
+    def summary(self):
+        """One row per session id with its session and submission counts."""
+        retries = {}
+        for (session, _), rows in self.session_rows.items():
+            retries[session] = retries.get(session, 0) + len(rows) - 1
+        rows = []
+        for session, starts in self.session_starts.items():
+            rows.append({
+                self.session_col: session,
+                'worker_ids': ';'.join(sorted(map(str, self.session_workers.get(session, [])))),
+                'n_sessions': len(starts),
+                'retry_submissions': retries.get(session, 0),
+                'first_start_time': self.first_start.get(session),
+                'repeated_session': len(starts) > 1,
+            })
+        return pd.DataFrame(rows)
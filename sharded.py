@@ -0,0 +1,258 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+import data_access
+from analyze import create_output_files
+
+
+# Files written by create_output_files for every shard, with the options
+# they were written with so the merged copies look the same.
+OUTPUT_FILES = {
+    'Participant.csv': {},
+    'Data.csv': {},
+    'Data_expanded.csv': {'quoting': 1, 'encoding': 'utf-8-sig'},
+    'data_expanded_after_checks.csv': {'quoting': 1, 'encoding': 'utf-8-sig'},
+    'participants_after_checks.csv': {},
+    'data_after_checks.csv': {},
+}
+
+SHARD_COLUMN = 'source_shard'
+MANIFEST_FILE = 'shard_manifest.json'
+
+
+def expand_database_paths(patterns):
+    """Expand files and glob patterns into a sorted, de-duplicated list of paths."""
+    paths = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True)
+        if not matches and os.path.exists(pattern):
+            matches = [pattern]
+        if not matches:
+            print(f"Warning: no database matches {pattern}")
+        paths.update(os.path.abspath(match) for match in matches)
+    return sorted(paths)
+
+
+def shard_names(database_paths):
+    """Name each shard by its path relative to the shards' common directory.
+
+    waves/w1/database.db and waves/w2/database.db become w1_database and
+    w2_database; a lone file is just named after its stem. Raises ValueError
+    if two paths map to the same name (waves/w1_database.db and
+    waves/w1/database.db).
+    """
+    parents = [os.path.dirname(path) for path in database_paths]
+    root = os.path.commonpath(parents) if parents else ''
+    names = {}
+    paths_by_name = {}
+    for path in database_paths:
+        relative = os.path.splitext(os.path.relpath(path, root))[0]
+        name = relative.replace(os.sep, '_')
+        names[path] = name
+        paths_by_name.setdefault(name, []).append(path)
+    collisions = {name: paths for name, paths in paths_by_name.items() if len(paths) > 1}
+    if collisions:
+        details = '; '.join(f"{name}: {', '.join(paths)}" for name, paths in sorted(collisions.items()))
+        raise ValueError(f"Databases share a shard name: {details}")
+    return names
+
+
+def shard_fingerprint(conn):
+    """Row count and last rowid of Participant and Data.
+
+    Based on the rows rather than the file, so the WAL switch and index
+    creation done when opening the database don't count as a change. The
+    experiment server only appends rows, which this catches.
+    """
+    fingerprint = {}
+    for table in ('Participant', 'Data'):
+        if data_access.table_exists(conn, table):
+            count, max_rowid = conn.execute(
+                f'SELECT COUNT(*), MAX(rowid) FROM "{table}"'
+            ).fetchone()
+            fingerprint[table] = [count, max_rowid]
+    return fingerprint
+
+
+def database_fingerprint(database_path):
+    with data_access.connection(database_path) as conn:
+        return shard_fingerprint(conn)
+
+
+def load_manifest(output_dir):
+    manifest_path = Path(output_dir) / MANIFEST_FILE
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(output_dir, manifest):
+    with open(Path(output_dir) / MANIFEST_FILE, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def process_shard(database_path, shard_dir):
+    """Expand and screen one database into shard_dir. Runs in a worker process.
+
+    shard_dir is emptied first so a failed run never leaves an earlier run's
+    files behind. Returns (succeeded, fingerprint), with the fingerprint taken
+    before anything is read: rows added during processing make the next run
+    reprocess the shard.
+    """
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    with data_access.connection(database_path) as conn:
+        fingerprint = shard_fingerprint(conn)
+        succeeded = create_output_files(database_path=database_path, output_dir=shard_dir)
+    return succeeded, fingerprint
+
+
+def read_shard_output(shard_dir, file_name):
+    path = Path(shard_dir) / file_name
+    if not path.exists():
+        return None
+    # Read everything back as text so values are written out exactly as the
+    # shard wrote them
+    return pd.read_csv(
+        path,
+        dtype=str,
+        keep_default_na=False,
+        encoding=OUTPUT_FILES[file_name].get('encoding'),
+    )
+
+
+def find_cross_shard_duplicates(participant_frames):
+    """Return worker_ids that appear in more than one shard's Participant table."""
+    worker_shards = pd.concat(
+        [df[['worker_id', SHARD_COLUMN]] for df in participant_frames if df is not None],
+        ignore_index=True,
+    ).drop_duplicates()
+    shard_counts = worker_shards.groupby('worker_id')[SHARD_COLUMN].nunique()
+    duplicated_ids = shard_counts[shard_counts > 1].index
+    duplicates = worker_shards[worker_shards['worker_id'].isin(duplicated_ids)]
+    return (
+        duplicates.groupby('worker_id')[SHARD_COLUMN]
+        .agg(lambda shards: ';'.join(sorted(shards)))
+        .rename('shards')
+        .reset_index()
+    )
+
+
+def merge_shard_outputs(shard_dirs, output_dir):
+    """Concatenate every shard's output files into output_dir, tagged by shard."""
+    output_dir = Path(output_dir)
+    participant_frames = []
+
+    for file_name, csv_options in OUTPUT_FILES.items():
+        frames = []
+        for shard, shard_dir in shard_dirs.items():
+            df = read_shard_output(shard_dir, file_name)
+            if df is None:
+                continue
+            df.insert(0, SHARD_COLUMN, shard)
+            frames.append(df)
+
+        if not frames:
+            print(f"No shard produced {file_name}")
+            continue
+
+        merged = pd.concat(frames, ignore_index=True)
+        merged.to_csv(output_dir / file_name, index=False, **csv_options)
+        print(f'✓ Successfully merged {len(frames)} shards into {file_name}')
+
+        if file_name == 'Participant.csv':
+            participant_frames = frames
+
+    if participant_frames:
+        duplicates = find_cross_shard_duplicates(participant_frames)
+        duplicates.to_csv(output_dir / 'cross_shard_duplicates.csv', index=False)
+        if duplicates.empty:
+            print('No worker_id appears in more than one shard')
+        else:
+            print(f"Warning: {len(duplicates)} worker_ids appear in more than one shard "
+                  f"(see cross_shard_duplicates.csv)")
+
+
+def run_sharded(patterns, output_dir='combined', max_workers=None, force=False):
+    """Screen every database matching patterns and merge the results.
+
+    Each shard is processed into output_dir/shards/<name>/. Shards whose
+    database has not changed since the last run are reused, so adding a wave
+    only costs that wave's processing time.
+    """
+    output_dir = Path(output_dir)
+    shards_root = output_dir / 'shards'
+    shards_root.mkdir(parents=True, exist_ok=True)
+
+    database_paths = expand_database_paths(patterns)
+    if not database_paths:
+        print('No databases to process')
+        return
+
+    names = shard_names(database_paths)
+    manifest = load_manifest(output_dir)
+    shard_dirs = {}
+    pending = {}
+
+    for database_path in database_paths:
+        shard = names[database_path]
+        shard_dirs[shard] = shards_root / shard
+        cached = manifest.get(shard)
+        if (not force and cached and cached['database_path'] == database_path
+                and cached['fingerprint'] == database_fingerprint(database_path)):
+            print(f"Reusing unchanged shard {shard}")
+            continue
+        pending[shard] = database_path
+
+    print(f"Processing {len(pending)} of {len(database_paths)} shards")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            shard: executor.submit(process_shard, database_path, str(shard_dirs[shard]))
+            for shard, database_path in pending.items()
+        }
+        for shard, future in futures.items():
+            database_path = pending[shard]
+            try:
+                succeeded, fingerprint = future.result()
+            except Exception as e:
+                print(f"Error processing shard {shard}: {e}")
+                succeeded = False
+            if succeeded:
+                manifest[shard] = {
+                    'database_path': database_path,
+                    'fingerprint': fingerprint,
+                }
+            else:
+                print(f"Shard {shard} failed; leaving it out of the merge")
+                manifest.pop(shard, None)
+                shard_dirs.pop(shard)
+            # Save after every shard so a crash doesn't lose finished work
+            save_manifest(output_dir, manifest)
+
+    merge_shard_outputs(shard_dirs, output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Screen several database.db files (waves/sites) and merge the outputs.'
+    )
+    parser.add_argument('databases', nargs='+', help='database files or glob patterns')
+    parser.add_argument('-o', '--output-dir', default='combined')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--force', action='store_true',
+                        help='reprocess every shard even if its database is unchanged')
+    args = parser.parse_args()
+    run_sharded(args.databases, output_dir=args.output_dir,
+                max_workers=args.workers, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
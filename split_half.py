@@ -0,0 +1,208 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from tmr_accumulator import is_repeat, load_latents, response_category, stimulus_index
+
+
+SEED = 628884
+N_SPLITS = 1000
+# (category index in tmr_accumulator.CATEGORIES, sign in the TMR direction)
+DIRECTION_CATEGORIES = [(0, 1.0), (1, -1.0)]
+
+
+def spearman_brown(r):
+    """Step a half-length reliability up to full length.
+
+    Apply it to the mean over splits, not to each split: the correction is
+    nonlinear and blows up near r = -1.
+    """
+    r = np.asarray(r, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 2 * r / (1 + r)
+
+
+def row_cosine(a, b, eps=1e-12):
+    """Cosine similarity between matching rows of a and b."""
+    numerator = np.einsum('ij,ij->i', a, b)
+    denominator = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    return numerator / np.maximum(denominator, eps)
+
+
+def participant_trials(subject_data, latents, condition):
+    """Stimulus indexes and response categories of a participant's usable trials.
+
+    Repeat presentations (and any phase other than main) are left out, so
+    each stimulus counts once even when get_main_data kept the repeats.
+    """
+    stimuli = []
+    categories = []
+    for trial in subject_data.to_dict('records'):
+        phase = trial.get('experiment_phase')
+        if is_repeat(trial.get('repeat')) or (isinstance(phase, str) and phase != 'main'):
+            continue
+        category = response_category(trial.get('response_label'), condition)
+        stim = trial.get('stimulus_index')
+        if stim is None or pd.isna(stim):
+            stim = stimulus_index(trial)
+        if category is None or stim is None or not 0 <= int(stim) < len(latents):
+            continue
+        stimuli.append(int(stim))
+        categories.append(category)
+    return np.array(stimuli, dtype=np.int64), np.array(categories, dtype=np.int64)
+
+
+def split_weights(categories, n_splits, rng):
+    """Weight matrices that turn a participant's trial latents into half-TMRs.
+
+    Trials are split in half separately within the positive and negative
+    categories, so both halves always contain both. Returns (W_a, W_b),
+    each of shape (n_splits, n_trials), or None if either category has fewer
+    than two trials. W_a @ trial_latents gives every split's first-half
+    positive_mean - negative_mean in one matmul.
+    """
+    n_trials = len(categories)
+    weights_a = np.zeros((n_splits, n_trials))
+    weights_b = np.zeros((n_splits, n_trials))
+
+    for category, sign in DIRECTION_CATEGORIES:
+        trial_indexes = np.flatnonzero(categories == category)
+        n_category = len(trial_indexes)
+        if n_category < 2:
+            return None
+        n_half = n_category // 2
+        # Ranking random keys gives an independent permutation per split
+        ranks = rng.random((n_splits, n_category)).argsort(axis=1).argsort(axis=1)
+        in_a = ranks < n_half
+        weights_a[:, trial_indexes] = np.where(in_a, sign / n_half, 0.0)
+        weights_b[:, trial_indexes] = np.where(in_a, 0.0, sign / (n_category - n_half))
+
+    return weights_a, weights_b
+
+
+def participant_split_halves(stimuli, categories, latents, n_splits, rng):
+    """Half-TMRs of shape (n_splits, latent_dim) for both halves, or None."""
+    weights = split_weights(categories, n_splits, rng)
+    if weights is None:
+        return None
+    weights_a, weights_b = weights
+    trial_latents = latents[stimuli]
+    return weights_a @ trial_latents, weights_b @ trial_latents
+
+
+def full_tmr(stimuli, categories, latents):
+    positive = latents[stimuli[categories == 0]].mean(axis=0)
+    negative = latents[stimuli[categories == 1]].mean(axis=0)
+    return positive - negative
+
+
+def split_half_reliability(main_data, latents, id_col='anon_id', n_splits=N_SPLITS, seed=SEED):
+    """Split-half reliability of each participant's TMR direction and group noise ceilings.
+
+    Args:
+        main_data (pd.DataFrame): Main-phase trials (as from get_main_data) with
+            id_col, 'condition', 'response_label' and 'stimulus_index' or 'stimulus'.
+            Repeat trials are ignored.
+        latents (np.ndarray): Shared stimulus latent matrix.
+        id_col (str): Participant id column.
+        n_splits (int): Random split-halves per participant.
+        seed (int): Seed for the split generator.
+
+    Returns:
+        tuple(pd.DataFrame, pd.DataFrame): Per-participant split-half cosine
+        (mean and SD over splits) with its Spearman-Brown correction, and
+        per-condition group split-half reliability plus lower/upper noise
+        ceilings from leave-one-out and all-in group means.
+    """
+    latents = np.asarray(latents, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+
+    participant_rows = []
+    # condition -> running sums of participants' half-TMRs (split s of the
+    # group uses split s of every participant), and the full TMRs
+    group_sums = {}
+    group_tmrs = {}
+
+    for subject_id, subject_data in main_data.groupby(id_col):
+        condition = str(subject_data['condition'].iloc[0])
+        stimuli, categories = participant_trials(subject_data, latents, condition)
+        row = {
+            id_col: subject_id,
+            'condition': condition,
+            'n_positive': int((categories == 0).sum()),
+            'n_negative': int((categories == 1).sum()),
+            'split_half_r': np.nan,
+            'split_half_r_sd': np.nan,
+            'spearman_brown_r': np.nan,
+        }
+
+        halves = participant_split_halves(stimuli, categories, latents, n_splits, rng)
+        if halves is not None:
+            half_a, half_b = halves
+            split_r = row_cosine(half_a, half_b)
+            row['split_half_r'] = split_r.mean()
+            row['split_half_r_sd'] = split_r.std()
+            row['spearman_brown_r'] = spearman_brown(split_r.mean())
+
+            if condition in group_sums:
+                group_sums[condition][0] += half_a
+                group_sums[condition][1] += half_b
+            else:
+                group_sums[condition] = [half_a, half_b]
+            group_tmrs.setdefault(condition, []).append(full_tmr(stimuli, categories, latents))
+
+        participant_rows.append(row)
+
+    condition_rows = []
+    for condition, (sum_a, sum_b) in group_sums.items():
+        tmrs = np.stack(group_tmrs[condition])
+        n_participants = len(tmrs)
+        # Cosine ignores scale, so the sums stand in for the group means
+        group_r = row_cosine(sum_a, sum_b)
+
+        group_sum = tmrs.sum(axis=0)
+        upper = row_cosine(tmrs, np.broadcast_to(group_sum / n_participants, tmrs.shape))
+        if n_participants > 1:
+            leave_one_out = (group_sum[None, :] - tmrs) / (n_participants - 1)
+            lower = row_cosine(tmrs, leave_one_out).mean()
+        else:
+            lower = np.nan
+
+        condition_rows.append({
+            'condition': condition,
+            'n_participants': n_participants,
+            'group_split_half_r': group_r.mean(),
+            'group_spearman_brown_r': spearman_brown(group_r.mean()),
+            'noise_ceiling_lower': lower,
+            'noise_ceiling_upper': upper.mean(),
+        })
+
+    return pd.DataFrame(participant_rows), pd.DataFrame(condition_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Split-half reliability of participant TMR directions and per-condition noise ceilings.'
+    )
+    parser.add_argument('main_data', help='CSV of main-phase trials')
+    parser.add_argument('--latents', default='Latents/latents.npz')
+    parser.add_argument('--id-col', default='anon_id')
+    parser.add_argument('--splits', type=int, default=N_SPLITS)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--output-prefix', default='split_half')
+    args = parser.parse_args()
+
+    main_data = pd.read_csv(args.main_data, dtype={args.id_col: str}, low_memory=False)
+    participants, conditions = split_half_reliability(
+        main_data, load_latents(args.latents),
+        id_col=args.id_col, n_splits=args.splits, seed=args.seed,
+    )
+    participants.to_csv(f'{args.output_prefix}_participants.csv', index=False)
+    conditions.to_csv(f'{args.output_prefix}_conditions.csv', index=False)
+    print(f'✓ Successfully exported {args.output_prefix}_participants.csv and {args.output_prefix}_conditions.csv')
+    print(conditions.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import json
+
+import pandas as pd
+import pytest
+
+import data_access
+from analyze import apply_checks, create_output_files, process_data_table, screen_participants
+
+
+@pytest.fixture
+def database_path(tmp_path, jspsych_data, write_database):
+    """The bundled data with one participant failing each of the first two checks."""
+    data = jspsych_data.copy()
+    anon_ids = data['anon_id'].unique()
+
+    small_screen = (data['anon_id'] == anon_ids[0]) & (data['trial_type'] == 'fullscreen')
+    data.loc[small_screen, ['screen_width', 'screen_height']] = [700, 500]
+
+    def not_serious(form_data):
+        form = json.loads(form_data)
+        form['seriousness'] = '10'
+        return json.dumps(form)
+
+    survey = (data['anon_id'] == anon_ids[1]) & data['form_data'].str.contains('seriousness', na=False)
+    data.loc[survey, 'form_data'] = data.loc[survey, 'form_data'].map(not_serious)
+
+    path = tmp_path / 'database.db'
+    write_database(path, data, chunk_size=50)
+    return path
+
+
+def test_screening_projection_matches_full_expansion(database_path, jspsych_data):
+    with data_access.connection(database_path) as conn:
+        expected = apply_checks(process_data_table(conn, export_path=None))['worker_id'].unique().tolist()
+        passed = screen_participants(conn)
+
+    anon_ids = jspsych_data['anon_id'].unique()
+    assert anon_ids[0] not in expected and anon_ids[1] not in expected
+    assert len(expected) > 0
+    assert passed == expected
+
+
+def test_expanded_data_flags_resaved_trials_and_later_sessions(tmp_path, jspsych_data, write_database):
+    first_id, second_id = jspsych_data['anon_id'].unique()[:2]
+    data = jspsych_data.loc[jspsych_data['anon_id'].isin([first_id, second_id])]
+    retry = data.loc[data['anon_id'] == first_id].head(10)
+    second_session = data.loc[data['anon_id'] == second_id].head(10).assign(
+        start_time=lambda df: (pd.to_datetime(df['start_time']) + pd.Timedelta('1D'))
+        .dt.strftime('%Y-%m-%dT%H:%M:%SZ'),
+    )
+    database_path = tmp_path / 'database.db'
+    for trials in [data, retry, second_session]:
+        write_database(database_path, trials)
+
+    assert create_output_files(database_path=database_path, output_dir=tmp_path)
+    expanded = pd.read_csv(tmp_path / 'Data_expanded.csv', encoding='utf-8-sig', low_memory=False)
+
+    keyed = expanded['stimulus_number'].notna()
+    expected_duplicates = (expanded['database_id'] == 3) & keyed
+    assert expanded['duplicate_trial'].tolist() == expected_duplicates.tolist()
+    assert expanded['first_session'].tolist() == (expanded['database_id'] != 4).tolist()
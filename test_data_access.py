@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+import data_access
+
+
+@pytest.fixture
+def database_path(tmp_path, rc_trials, write_database):
+    path = tmp_path / 'database.db'
+    write_database(path, rc_trials, chunk_size=50)
+    return path
+
+
+def test_worker_read_matches_in_query(database_path, rc_trials):
+    worker_ids = rc_trials['worker_id'].unique()[::2].tolist()
+    with data_access.connection(database_path) as conn:
+        data_access.ensure_indexes(conn)
+        expected = pd.read_sql_query(
+            'SELECT * FROM Data WHERE worker_id IN ({}) ORDER BY rowid'.format(
+                ', '.join('?' * len(worker_ids))
+            ), conn, params=worker_ids,
+        )
+        # Batches of two workers, read two rows at a time
+        actual = data_access.read_data_for_workers(conn, worker_ids, page_size=2)
+
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(
+        actual.sort_values('id', ignore_index=True), expected.sort_values('id', ignore_index=True)
+    )
+
+
+def test_worker_read_uses_worker_index(database_path, rc_trials):
+    worker_ids = rc_trials['worker_id'].unique().tolist()
+    statements = []
+    with data_access.connection(database_path) as conn:
+        data_access.ensure_indexes(conn)
+        conn.set_trace_callback(statements.append)
+        data_access.read_data_for_workers(conn, worker_ids)
+        conn.set_trace_callback(None)
+        query = next(sql for sql in statements if sql.startswith('SELECT') and 'FROM Data' in sql)
+
+        data_access.load_worker_ids(conn, worker_ids)
+        plan = conn.execute(f'EXPLAIN QUERY PLAN {query}').fetchall()
+        data_access.drop_worker_ids(conn)
+    details = ' '.join(row[-1] for row in plan)
+    assert 'idx_data_worker_id' in details
+    assert 'SCAN d' not in details
+
+
+def test_worker_read_leaves_no_open_transaction(database_path, rc_trials, write_database):
+    worker_ids = rc_trials['worker_id'].unique().tolist()
+    with data_access.connection(database_path) as conn:
+        pages = data_access.iter_data_for_workers(conn, worker_ids, page_size=2)
+        next(pages)
+        pages.close()
+        assert not conn.in_transaction
+        assert conn.execute(
+            "SELECT 1 FROM sqlite_temp_master WHERE name = 'passed_workers'"
+        ).fetchone() is None
+
+        before = len(data_access.read_data_for_workers(conn, worker_ids))
+        assert not conn.in_transaction
+        # Rows saved by another connection are visible to the shared one
+        write_database(database_path, rc_trials.head(1), chunk_size=1)
+        assert len(data_access.read_data_for_workers(conn, worker_ids)) == before + 1
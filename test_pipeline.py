@@ -0,0 +1,80 @@
+import os
+import re
+import shutil
+
+import pytest
+
+import pipeline
+
+
+@pytest.fixture
+def run(tmp_path, data_path, latents_path, capsys):
+    """Run the pipeline offline on a copy of the bundled data; returns its output."""
+    data_copy = tmp_path / 'jspsych_data.csv'
+    shutil.copy(data_path, data_copy)
+
+    def run_pipeline(*extra):
+        pipeline.main([
+            '--no-decode',
+            '--data', str(data_copy),
+            '--latents', str(latents_path),
+            '--save-path', str(tmp_path / 'results'),
+            '--checkpoint-dir', str(tmp_path / 'checkpoints'),
+            *extra,
+        ])
+        return capsys.readouterr().out
+
+    run_pipeline.data_path = data_copy
+    run_pipeline.subject_results = tmp_path / 'checkpoints' / 'results'
+    return run_pipeline
+
+
+def ran_stages(out):
+    return re.findall(r'^Running (\w+)\.\.\.$', out, flags=re.MULTILINE)
+
+
+def computed_subjects(out):
+    return re.findall(r'^subject = (\S+)$', out, flags=re.MULTILINE)
+
+
+def test_checkpointed_stages_are_skipped(run):
+    out = run()
+    assert ran_stages(out) == pipeline.STAGES
+    subjects = computed_subjects(out)
+    assert subjects
+    assert sorted(path.stem for path in run.subject_results.glob('*.pkl')) == sorted(subjects)
+
+    out = run()
+    # reels never checkpoints under --no-decode
+    assert ran_stages(out) == ['reels']
+    assert computed_subjects(out) == []
+
+
+def test_from_stage_results_reuses_subject_results(run):
+    subjects = computed_subjects(run())
+    (run.subject_results / f'{subjects[0]}.pkl').unlink()
+
+    out = run('--from-stage', 'results')
+    assert ran_stages(out) == ['results', 'condition_averages', 'reels']
+    # Only the subject without a checkpoint is computed again
+    assert computed_subjects(out) == [subjects[0]]
+
+
+@pytest.mark.parametrize('change, first_stage', [
+    (['--exclude', 'XXX'], 'clean_data'),
+    (['--seed', '1'], 'results'),
+    ('touch', 'load_data'),
+])
+def test_changed_options_rerun_from_their_stage(run, change, first_stage):
+    subjects = computed_subjects(run())
+
+    if change == 'touch':
+        stat = os.stat(run.data_path)
+        os.utime(run.data_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        change = []
+    out = run(*change)
+
+    assert f'recomputing from the {first_stage} stage' in out
+    assert ran_stages(out) == pipeline.STAGES[pipeline.STAGES.index(first_stage):]
+    # Subject results depend on every option, so none are reused
+    assert sorted(computed_subjects(out)) == sorted(subjects)
@@ -0,0 +1,63 @@
+import pandas as pd
+import pytest
+
+from session_index import SessionIndex
+
+
+@pytest.fixture(scope='module')
+def trials(rc_trials):
+    """Bundled trials plus a retried save and a second session.
+
+    Each participant's trials are one Data row. The first participant's
+    opening trials are saved again under another row (a retry), and the
+    second participant's opening trials come back a day later (a new session).
+    """
+    data = rc_trials.copy()
+    data['database_id'] = data['anon_id'].factorize()[0].astype(str)
+    anon_ids = data['anon_id'].unique()
+
+    retry = data.loc[data['anon_id'] == anon_ids[0]].head(10).assign(database_id='retry')
+    second_session = data.loc[data['anon_id'] == anon_ids[1]].head(10).assign(
+        database_id='second',
+        start_time=lambda df: (pd.to_datetime(df['start_time']) + pd.Timedelta('1D'))
+        .dt.strftime('%Y-%m-%dT%H:%M:%SZ'),
+    )
+    frame = pd.concat([data, retry, second_session], ignore_index=True)
+    frame['kind'] = ['original'] * len(data) + ['retry'] * len(retry) + ['second'] * len(second_session)
+    return frame
+
+
+def test_duplicate_flags_mark_only_resaved_trials(trials):
+    index = SessionIndex()
+    flags = [index.add(trial) for trial in trials.to_dict('records')]
+    assert flags == (trials['kind'] == 'retry').tolist()
+    assert index.duplicate_mask(trials).tolist() == flags
+
+
+def test_first_session_mask_matches_groupby_min(trials):
+    index = SessionIndex.from_frame(trials)
+    mask = index.first_session_mask(trials)
+    assert mask.tolist() == (trials['kind'] != 'second').tolist()
+
+    starts = pd.to_datetime(trials['start_time'])
+    expected = starts == starts.groupby(trials['anon_id']).transform('min')
+    assert mask.tolist() == expected.tolist()
+
+
+def test_summary_counts_sessions_and_retries(trials):
+    anon_ids = trials['anon_id'].unique()
+    summary = SessionIndex.from_frame(trials).summary().set_index('anon_id')
+
+    assert summary.loc[anon_ids[0], 'retry_submissions'] == 1
+    assert summary.loc[anon_ids[0], 'n_sessions'] == 1
+    assert summary.loc[anon_ids[1], 'n_sessions'] == 2
+    assert summary.loc[anon_ids[1], 'retry_submissions'] == 0
+    assert summary['repeated_session'].tolist() == [anon_id == anon_ids[1] for anon_id in summary.index]
+    assert summary.loc[anon_ids[0], 'worker_ids'] == anon_ids[0]
+
+
+def test_annotate_adds_flags(trials):
+    annotated = SessionIndex.from_frame(trials).annotate(trials)
+    assert annotated['duplicate_trial'].tolist() == (trials['kind'] == 'retry').tolist()
+    assert annotated['first_session'].tolist() == (trials['kind'] != 'second').tolist()
+    assert 'duplicate_trial' not in trials.columns
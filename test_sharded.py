@@ -0,0 +1,90 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from analyze import create_output_files
+from sharded import MANIFEST_FILE, SHARD_COLUMN, load_manifest, run_sharded
+
+
+@pytest.fixture
+def waves(tmp_path, jspsych_data, write_database):
+    """Two waves of three participants each; the first participant is in both."""
+    anon_ids = jspsych_data['anon_id'].unique()
+    paths = {}
+    for wave, wave_ids in [('w1', anon_ids[:3]), ('w2', [anon_ids[0], *anon_ids[3:]])]:
+        path = tmp_path / 'waves' / wave / 'database.db'
+        path.parent.mkdir(parents=True)
+        write_database(path, jspsych_data.loc[jspsych_data['anon_id'].isin(wave_ids)])
+        paths[wave] = path
+    return paths
+
+
+def run(waves, output_dir, capsys, force=False):
+    run_sharded([str(path) for path in waves.values()], output_dir=output_dir, force=force)
+    return capsys.readouterr().out
+
+
+def test_merged_outputs_are_tagged_by_shard(tmp_path, waves, jspsych_data, capsys):
+    output_dir = tmp_path / 'combined'
+    out = run(waves, output_dir, capsys)
+    assert 'Processing 2 of 2 shards' in out
+
+    shared_id = jspsych_data['anon_id'].iloc[0]
+    participants = pd.read_csv(output_dir / 'Participant.csv', dtype=str)
+    assert participants.groupby(SHARD_COLUMN).size().to_dict() == {'w1_database': 3, 'w2_database': 4}
+    expanded = pd.read_csv(output_dir / 'Data_expanded.csv', dtype=str, encoding='utf-8-sig')
+    assert set(expanded[SHARD_COLUMN]) == {'w1_database', 'w2_database'}
+    assert len(expanded) == len(jspsych_data) + (jspsych_data['anon_id'] == shared_id).sum()
+
+    duplicates = pd.read_csv(output_dir / 'cross_shard_duplicates.csv', dtype=str)
+    assert duplicates.to_dict('records') == [
+        {'worker_id': shared_id, 'shards': 'w1_database;w2_database'}
+    ]
+
+
+def test_unchanged_shards_are_reused(tmp_path, waves, jspsych_data, write_database, capsys):
+    output_dir = tmp_path / 'combined'
+    run(waves, output_dir, capsys)
+    manifest = load_manifest(output_dir)
+    assert set(manifest) == {'w1_database', 'w2_database'}
+
+    out = run(waves, output_dir, capsys)
+    assert 'Reusing unchanged shard w1_database' in out
+    assert 'Reusing unchanged shard w2_database' in out
+    assert 'Processing 0 of 2 shards' in out
+
+    # New rows in one wave reprocess only that wave
+    write_database(waves['w2'], jspsych_data.head(5))
+    out = run(waves, output_dir, capsys)
+    assert 'Reusing unchanged shard w1_database' in out
+    assert 'Processing 1 of 2 shards' in out
+    assert load_manifest(output_dir)['w2_database'] != manifest['w2_database']
+
+
+def test_failed_shard_is_left_out(tmp_path, waves, capsys):
+    output_dir = tmp_path / 'combined'
+    conn = sqlite3.connect(waves['w2'])
+    conn.execute('DROP TABLE Data')
+    conn.commit()
+    conn.close()
+
+    out = run(waves, output_dir, capsys)
+    assert 'Shard w2_database failed; leaving it out of the merge' in out
+    assert set(load_manifest(output_dir)) == {'w1_database'}
+    participants = pd.read_csv(output_dir / 'Participant.csv', dtype=str)
+    assert set(participants[SHARD_COLUMN]) == {'w1_database'}
+    assert (output_dir / MANIFEST_FILE).exists()
+
+
+def test_database_without_trials_is_exported(tmp_path, jspsych_data, write_database, capsys):
+    database_path = tmp_path / 'database.db'
+    write_database(database_path, jspsych_data.head(3))
+    conn = sqlite3.connect(database_path)
+    conn.execute('DELETE FROM Data')
+    conn.commit()
+    conn.close()
+
+    assert create_output_files(database_path=database_path, output_dir=tmp_path / 'out')
+    assert 'No trial data found to export' in capsys.readouterr().out
+    assert (tmp_path / 'out' / 'Participant.csv').exists()
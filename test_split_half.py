@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from split_half import (
+    participant_split_halves, participant_trials, split_half_reliability, split_weights,
+)
+
+
+@pytest.fixture(scope='module')
+def latents(latents):
+    return latents.astype(np.float64)
+
+
+@pytest.fixture(scope='module')
+def main_data(rc_trials):
+    return rc_trials.loc[~rc_trials['repeat']]
+
+
+@pytest.fixture(scope='module')
+def participant(main_data, latents):
+    subject_data = main_data.loc[main_data['anon_id'] == main_data['anon_id'].iloc[0]]
+    return participant_trials(subject_data, latents, subject_data['condition'].iloc[0])
+
+
+def test_split_weights_halve_each_category(participant):
+    _, categories = participant
+    weights_a, weights_b = split_weights(categories, 50, np.random.default_rng(0))
+    assert weights_a.shape == weights_b.shape == (50, len(categories))
+
+    for category, sign in [(0, 1.0), (1, -1.0)]:
+        in_category = categories == category
+        n_category = in_category.sum()
+        in_a = weights_a[:, in_category] != 0
+        in_b = weights_b[:, in_category] != 0
+        # Every trial lands in exactly one half, with half of them in a
+        assert (in_a ^ in_b).all()
+        assert (in_a.sum(axis=1) == n_category // 2).all()
+        # Each half averages its trials, signed by the category's direction
+        np.testing.assert_allclose(weights_a[:, in_category].sum(axis=1), sign)
+        np.testing.assert_allclose(weights_b[:, in_category].sum(axis=1), sign)
+
+    neither = ~np.isin(categories, [0, 1])
+    assert not weights_a[:, neither].any() and not weights_b[:, neither].any()
+
+
+def test_split_weights_need_two_trials_per_category():
+    rng = np.random.default_rng(0)
+    assert split_weights(np.array([0, 1, 1, 2]), 10, rng) is None
+    assert split_weights(np.array([0, 0, 1, 1]), 10, rng) is not None
+
+
+def test_split_halves_match_explicit_means(participant, latents):
+    stimuli, categories = participant
+    half_a, half_b = participant_split_halves(stimuli, categories, latents, 20, np.random.default_rng(1))
+    weights_a, weights_b = split_weights(categories, 20, np.random.default_rng(1))
+
+    for split in range(20):
+        for half, weights in [(half_a, weights_a), (half_b, weights_b)]:
+            chosen = weights[split] != 0
+            positive = latents[stimuli[chosen & (categories == 0)]].mean(axis=0)
+            negative = latents[stimuli[chosen & (categories == 1)]].mean(axis=0)
+            np.testing.assert_allclose(half[split], positive - negative)
+
+
+def test_split_half_reliability_is_seeded(main_data, latents):
+    participants, conditions = split_half_reliability(main_data, latents, n_splits=50, seed=3)
+    again_participants, again_conditions = split_half_reliability(main_data, latents, n_splits=50, seed=3)
+    pd.testing.assert_frame_equal(participants, again_participants)
+    pd.testing.assert_frame_equal(conditions, again_conditions)
+
+    assert len(participants) == main_data['anon_id'].nunique()
+    assert participants['split_half_r'].between(-1, 1).all()
+    r = participants['split_half_r']
+    np.testing.assert_allclose(participants['spearman_brown_r'], 2 * r / (1 + r))
+    group_r = conditions['group_split_half_r']
+    np.testing.assert_allclose(conditions['group_spearman_brown_r'], 2 * group_r / (1 + group_r))
+    expected_counts = main_data.groupby('condition')['anon_id'].nunique()
+    assert conditions.set_index('condition')['n_participants'].to_dict() == expected_counts.to_dict()
+    assert (conditions['noise_ceiling_lower'] <= conditions['noise_ceiling_upper']).all()
+
+
+def test_repeat_trials_are_left_out(rc_trials, main_data, latents):
+    subject_id = main_data['anon_id'].iloc[0]
+    with_repeats = rc_trials.loc[rc_trials['anon_id'] == subject_id]
+    assert with_repeats['repeat'].any()
+
+    condition = with_repeats['condition'].iloc[0]
+    stimuli, categories = participant_trials(with_repeats, latents, condition)
+    expected_stimuli, expected_categories = participant_trials(
+        main_data.loc[main_data['anon_id'] == subject_id], latents, condition
+    )
+    np.testing.assert_array_equal(stimuli, expected_stimuli)
+    np.testing.assert_array_equal(categories, expected_categories)
+    assert len(np.unique(stimuli)) == len(stimuli)
+
+    participants, _ = split_half_reliability(rc_trials, latents, n_splits=50, seed=3)
+    expected, _ = split_half_reliability(main_data, latents, n_splits=50, seed=3)
+    pd.testing.assert_frame_equal(participants, expected)
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_access
+from tmr_accumulator import CATEGORIES, CATEGORY_SCORES, TMRAccumulator, response_category
+
+
+@pytest.fixture(scope='module')
+def trials(rc_trials):
+    return rc_trials.assign(category=[
+        response_category(label, condition)
+        for label, condition in zip(rc_trials['response_label'], rc_trials['condition'])
+    ])
+
+
+def repeat_pairs(trials):
+    scored = trials.assign(score=CATEGORY_SCORES[trials['category'].to_numpy()])
+    key = ['worker_id', 'stimulus_number']
+    first = scored.loc[~scored['repeat']].set_index(key)['score']
+    repeat = scored.loc[scored['repeat']].set_index(key)['score']
+    return pd.concat([first, repeat], axis=1, keys=['first', 'repeat'], join='inner')
+
+
+def test_counts_match_response_crosstab(trials, latents):
+    accumulator = TMRAccumulator(latents)
+    accumulator.update(trials)
+
+    first = trials.loc[~trials['repeat']]
+    expected = pd.crosstab(first['worker_id'], first['category'])
+    expected = expected.reindex(columns=range(len(CATEGORIES)), fill_value=0)
+    summary = accumulator.summary().set_index('worker_id')
+    for index, category in enumerate(CATEGORIES):
+        assert summary[f'{category}_count'].to_dict() == expected[index].to_dict()
+
+
+def test_means_match_batch_average(trials, latents):
+    accumulator = TMRAccumulator(latents)
+    accumulator.update(trials)
+    averages = accumulator.averages().set_index('worker_id')
+
+    first = trials.loc[~trials['repeat']]
+    for (worker_id, category), group in first.groupby(['worker_id', 'category']):
+        expected = latents[group['stimulus_number'].astype(int)].astype(np.float64).mean(axis=0)
+        np.testing.assert_allclose(averages.loc[worker_id, f'{CATEGORIES[category]}_mean'], expected)
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def test_reliability_matches_repeat_pairs(trials, latents, reverse):
+    # Reversed order sees every repeat before its first presentation
+    accumulator = TMRAccumulator(latents)
+    accumulator.update(trials.iloc[::-1] if reverse else trials)
+    reliability = accumulator.reliability().set_index('worker_id')
+
+    for worker_id, pairs in repeat_pairs(trials).groupby(level='worker_id'):
+        row = reliability.loc[worker_id]
+        assert row['pairs'] == len(pairs)
+        assert row['agreement'] == pytest.approx(2 * (pairs['first'] == pairs['repeat']).mean() - 1)
+        if pairs['first'].std() > 0 and pairs['repeat'].std() > 0:
+            expected_r = np.corrcoef(pairs['first'], pairs['repeat'])[0, 1]
+            assert row['pearson_r'] == pytest.approx(expected_r)
+        else:
+            assert np.isnan(row['pearson_r'])
+
+
+def test_save_load_resumes_from_last_rowid(tmp_path, trials, latents, write_database):
+    database_path = tmp_path / 'database.db'
+    state_path = tmp_path / 'tmr_state.npz'
+    # Split mid-participant so repeat pairs are still open when the state is saved
+    split = len(trials) // 2 + 50
+    write_database(database_path, trials.iloc[:split], chunk_size=100)
+
+    accumulator = TMRAccumulator(latents)
+    with data_access.connection(database_path) as conn:
+        accumulator.update_from_database(conn, page_size=2)
+    accumulator.save(state_path)
+    assert accumulator.first_scores
+
+    write_database(database_path, trials.iloc[split:], chunk_size=100)
+    resumed = TMRAccumulator.load(state_path, latents)
+    assert resumed.last_rowid == accumulator.last_rowid
+    assert resumed.first_scores == accumulator.first_scores
+    assert resumed.seen_trials == accumulator.seen_trials
+    assert resumed.session_starts == accumulator.session_starts
+    with data_access.connection(database_path) as conn:
+        added = resumed.update_from_database(conn, page_size=2)
+    assert added == len(trials) - split
+
+    batch = TMRAccumulator(latents)
+    batch.update(trials)
+    pd.testing.assert_frame_equal(
+        resumed.summary().sort_values('worker_id', ignore_index=True),
+        batch.summary().sort_values('worker_id', ignore_index=True),
+    )
+    resumed_tmrs = resumed.tmrs()
+    for worker_id, tmr in batch.tmrs().items():
+        np.testing.assert_allclose(resumed_tmrs[worker_id], tmr)
+
+
+def test_resaved_trials_and_later_sessions_are_skipped(trials, latents):
+    batch = TMRAccumulator(latents)
+    batch.update(trials)
+
+    first_id, second_id = trials['anon_id'].unique()[:2]
+    retry = trials.loc[trials['anon_id'] == first_id].head(100)
+    # Same participant coming back a day later with fresh responses
+    second_session = trials.loc[trials['anon_id'] == second_id].head(100).assign(
+        start_time=lambda df: (pd.to_datetime(df['start_time']) + pd.Timedelta('1D'))
+        .dt.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        response_label=lambda df: df['response_label'].iloc[::-1].to_numpy(),
+    )
+    accumulator = TMRAccumulator(latents)
+    added = accumulator.update(pd.concat([trials, retry, second_session]))
+    assert added == len(trials)
+
+    pd.testing.assert_frame_equal(accumulator.summary(), batch.summary())
+    accumulator_tmrs = accumulator.tmrs()
+    for worker_id, tmr in batch.tmrs().items():
+        np.testing.assert_allclose(accumulator_tmrs[worker_id], tmr)
@@ -0,0 +1,313 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import data_access
+from analyze import expand_data_row, screen_participants
+
+
+RC_TRIAL_TYPE = 'single-stim-rev-cor-trial'
+CATEGORIES = ['positive', 'negative', 'neither']
+# Same scoring as the repeat-pair reliability in the notebook
+CATEGORY_SCORES = np.array([1, -1, 0])
+# n, matches, sum(x), sum(y), sum(x^2), sum(y^2), sum(xy) over repeat pairs
+PAIR_STAT_FIELDS = ['n', 'matches', 'sx', 'sy', 'sxx', 'syy', 'sxy']
+# Trial fields read by add_trial; worker_id and condition come from the Data row
+TRIAL_FIELDS = ['trial_type', 'response_label', 'stimulus', 'stimulus_number',
+                'repeat', 'anon_id', 'start_time']
+
+
+def load_latents(path='Latents/latents.npz'):
+    return np.load(path)['data']
+
+
+def response_category(response_label, condition):
+    """Map a response label to an index into CATEGORIES, or None if unusable."""
+    if not isinstance(response_label, str):
+        return None
+    label = response_label.strip().lower()
+    condition = str(condition).strip().lower()
+    if label in (condition, 'yes'):
+        return 0
+    if label in (f'no {condition}', 'no'):
+        return 1
+    if label == 'not sure':
+        return 2
+    return None
+
+
+def stimulus_index(trial):
+    """Row of the shared latent matrix shown on this trial."""
+    stimulus = trial.get('stimulus')
+    if isinstance(stimulus, str) and stimulus:
+        name = os.path.splitext(os.path.basename(stimulus))[0]
+        if name.isdigit():
+            return int(name)
+    try:
+        return int(float(trial.get('stimulus_number')))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_repeat(value):
+    if isinstance(value, str):
+        return value.strip().lower() == 'true'
+    return bool(value) and not pd.isna(value)
+
+
+class TMRAccumulator:
+    """Running per-participant latent sums, so TMRs are available mid-collection.
+
+    Each main-phase trial adds its stimulus latent to the participant's sum for
+    the chosen response category. Repeat trials are only paired with the first
+    presentation for reliability. Every update is O(trials added).
+
+    Only the first session seen for each anon_id (by start_time) is counted,
+    and a trial already seen for the same worker, stimulus and repeat flag
+    (a retried save) is skipped, as get_main_data and the SessionIndex do.
+    """
+
+    def __init__(self, latents):
+        self.latents = np.asarray(latents, dtype=np.float64)
+        self.sums = {}
+        self.counts = {}
+        self.conditions = {}
+        self.pair_stats = {}
+        # (worker_id, stimulus) -> score of a presentation still waiting for its pair
+        self.first_scores = {}
+        self.unpaired_repeats = {}
+        # (worker_id, stimulus, repeat) of every trial counted so far
+        self.seen_trials = set()
+        # anon_id -> start_time of the session being counted
+        self.session_starts = {}
+        self.last_rowid = 0
+
+    def _ensure_worker(self, worker_id, condition):
+        if worker_id not in self.sums:
+            self.sums[worker_id] = np.zeros((len(CATEGORIES), self.latents.shape[1]))
+            self.counts[worker_id] = np.zeros(len(CATEGORIES), dtype=np.int64)
+            self.pair_stats[worker_id] = np.zeros(len(PAIR_STAT_FIELDS))
+            self.conditions[worker_id] = condition
+
+    def _add_pair(self, worker_id, first, repeat):
+        self.pair_stats[worker_id] += [
+            1, first == repeat, first, repeat, first * first, repeat * repeat, first * repeat
+        ]
+
+    def add_trial(self, trial):
+        """Add one expanded trial (a dict as produced by expand_data_row)."""
+        if trial.get('trial_type') != RC_TRIAL_TYPE:
+            return False
+
+        worker_id = str(trial.get('worker_id', ''))
+        condition = str(trial.get('condition', ''))
+        category = response_category(trial.get('response_label'), condition)
+        stim = stimulus_index(trial)
+        if category is None or stim is None or not 0 <= stim < len(self.latents):
+            return False
+
+        anon_id = trial.get('anon_id')
+        start_time = trial.get('start_time')
+        if isinstance(anon_id, str) and isinstance(start_time, str):
+            if self.session_starts.setdefault(anon_id, start_time) != start_time:
+                return False
+
+        repeat = is_repeat(trial.get('repeat'))
+        if (worker_id, stim, repeat) in self.seen_trials:
+            return False
+        self.seen_trials.add((worker_id, stim, repeat))
+
+        self._ensure_worker(worker_id, condition)
+        score = CATEGORY_SCORES[category]
+        key = (worker_id, stim)
+
+        if repeat:
+            if key in self.first_scores:
+                self._add_pair(worker_id, self.first_scores.pop(key), score)
+            else:
+                self.unpaired_repeats[key] = score
+            return True
+
+        self.sums[worker_id][category] += self.latents[stim]
+        self.counts[worker_id][category] += 1
+        if key in self.unpaired_repeats:
+            self._add_pair(worker_id, score, self.unpaired_repeats.pop(key))
+        else:
+            self.first_scores[key] = score
+        return True
+
+    def update(self, trials):
+        """Add expanded trials from a DataFrame or an iterable of dicts."""
+        if isinstance(trials, pd.DataFrame):
+            trials = trials.to_dict('records')
+        return sum(self.add_trial(trial) for trial in trials)
+
+    def update_from_database(self, conn, page_size=data_access.PAGE_SIZE):
+        """Add trials from Data rows inserted since the last call.
+
+        Only TRIAL_FIELDS are expanded from each row's json_data.
+        """
+        added = 0
+        for page in data_access.iter_table(
+            conn, 'Data', columns=['id', 'worker_id', 'condition', 'json_data'],
+            page_size=page_size, after_rowid=self.last_rowid, keep_rowid=True
+        ):
+            for row in page.to_dict('records'):
+                added += self.update(expand_data_row(row, fields=TRIAL_FIELDS))
+            self.last_rowid = int(page['_rowid'].iloc[-1])
+        return added
+
+    def averages(self):
+        """Per-participant category means and TMR (X - N + U).
+
+        Means are NaN for categories with no responses yet; the TMR is NaN
+        until all three categories have at least one response.
+        """
+        rows = []
+        for worker_id, sums in self.sums.items():
+            counts = self.counts[worker_id]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means = sums / counts[:, None]
+            row = {'worker_id': worker_id, 'condition': self.conditions[worker_id]}
+            for category, mean in zip(CATEGORIES, means):
+                row[f'{category}_mean'] = mean
+            row['tmr'] = means[0] - means[1] + means[2]
+            rows.append(row)
+        return pd.DataFrame(rows, columns=['worker_id', 'condition', 'positive_mean',
+                                           'negative_mean', 'neither_mean', 'tmr'])
+
+    def tmrs(self):
+        """TMR vectors of participants with responses in every category."""
+        averages = self.averages()
+        complete = [worker_id for worker_id, counts in self.counts.items() if counts.all()]
+        averages = averages[averages['worker_id'].isin(complete)]
+        return dict(zip(averages['worker_id'], averages['tmr']))
+
+    def reliability(self):
+        """Repeat-pair agreement (-1 to +1) and Pearson r per participant."""
+        rows = []
+        for worker_id, stats in self.pair_stats.items():
+            n, matches, sx, sy, sxx, syy, sxy = stats
+            agreement = (2 * matches - n) / n if n else np.nan
+            denominator = np.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy))
+            pearson_r = (n * sxy - sx * sy) / denominator if n >= 2 and denominator > 0 else np.nan
+            rows.append({
+                'worker_id': worker_id,
+                'pairs': int(n),
+                'agreement': agreement,
+                'pearson_r': pearson_r,
+            })
+        return pd.DataFrame(rows, columns=['worker_id', 'pairs', 'agreement', 'pearson_r'])
+
+    def summary(self):
+        """One row per participant: condition, response counts and reliability."""
+        counts = pd.DataFrame(
+            [[worker_id, self.conditions[worker_id], *counts] for worker_id, counts in self.counts.items()],
+            columns=['worker_id', 'condition'] + [f'{category}_count' for category in CATEGORIES],
+        )
+        return counts.merge(self.reliability(), on='worker_id', how='left')
+
+    def save(self, path):
+        """Write the state to a compressed .npz, replacing path atomically."""
+        worker_ids = list(self.sums)
+        first_keys = list(self.first_scores)
+        repeat_keys = list(self.unpaired_repeats)
+        seen_keys = list(self.seen_trials)
+        dim = self.latents.shape[1]
+        tmp_path = f'{path}.tmp.npz'
+        np.savez_compressed(
+            tmp_path,
+            latent_dim=dim,
+            last_rowid=self.last_rowid,
+            worker_ids=np.array(worker_ids, dtype=str),
+            conditions=np.array([self.conditions[w] for w in worker_ids], dtype=str),
+            sums=np.array([self.sums[w] for w in worker_ids]).reshape(-1, len(CATEGORIES), dim),
+            counts=np.array([self.counts[w] for w in worker_ids], dtype=np.int64).reshape(-1, len(CATEGORIES)),
+            pair_stats=np.array([self.pair_stats[w] for w in worker_ids]).reshape(-1, len(PAIR_STAT_FIELDS)),
+            first_workers=np.array([w for w, _ in first_keys], dtype=str),
+            first_stimuli=np.array([s for _, s in first_keys], dtype=np.int64),
+            first_scores=np.array(list(self.first_scores.values()), dtype=np.int64),
+            repeat_workers=np.array([w for w, _ in repeat_keys], dtype=str),
+            repeat_stimuli=np.array([s for _, s in repeat_keys], dtype=np.int64),
+            repeat_scores=np.array(list(self.unpaired_repeats.values()), dtype=np.int64),
+            seen_workers=np.array([w for w, _, _ in seen_keys], dtype=str),
+            seen_stimuli=np.array([s for _, s, _ in seen_keys], dtype=np.int64),
+            seen_repeats=np.array([r for _, _, r in seen_keys], dtype=bool),
+            session_ids=np.array(list(self.session_starts), dtype=str),
+            session_starts=np.array(list(self.session_starts.values()), dtype=str),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, latents):
+        accumulator = cls(latents)
+        with np.load(path, allow_pickle=False) as state:
+            if int(state['latent_dim']) != accumulator.latents.shape[1]:
+                raise ValueError(
+                    f"State in {path} was built with {int(state['latent_dim'])}-d latents, "
+                    f"got {accumulator.latents.shape[1]}-d"
+                )
+            accumulator.last_rowid = int(state['last_rowid'])
+            # Each state[...] lookup decompresses the whole array, so read them once
+            sums = state['sums'].astype(np.float64)
+            counts = state['counts'].astype(np.int64)
+            pair_stats = state['pair_stats'].astype(np.float64)
+            conditions = state['conditions'].tolist()
+            for i, worker_id in enumerate(state['worker_ids'].tolist()):
+                accumulator.sums[worker_id] = sums[i]
+                accumulator.counts[worker_id] = counts[i]
+                accumulator.pair_stats[worker_id] = pair_stats[i]
+                accumulator.conditions[worker_id] = conditions[i]
+            accumulator.first_scores = {
+                (w, int(s)): int(score) for w, s, score in
+                zip(state['first_workers'].tolist(), state['first_stimuli'], state['first_scores'])
+            }
+            accumulator.unpaired_repeats = {
+                (w, int(s)): int(score) for w, s, score in
+                zip(state['repeat_workers'].tolist(), state['repeat_stimuli'], state['repeat_scores'])
+            }
+            accumulator.seen_trials = set(zip(
+                state['seen_workers'].tolist(), state['seen_stimuli'].tolist(), state['seen_repeats'].tolist()
+            ))
+            accumulator.session_starts = dict(zip(
+                state['session_ids'].tolist(), state['session_starts'].tolist()
+            ))
+        return accumulator
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Update running TMRs from new Data rows and print a collection summary.'
+    )
+    parser.add_argument('database', nargs='?', default='database.db')
+    parser.add_argument('--latents', default='Latents/latents.npz')
+    parser.add_argument('--state', default='tmr_state.npz')
+    parser.add_argument('--passed-only', action='store_true',
+                        help='only summarise participants who pass the screening checks')
+    args = parser.parse_args()
+
+    latents = load_latents(args.latents)
+    if os.path.exists(args.state):
+        accumulator = TMRAccumulator.load(args.state, latents)
+    else:
+        accumulator = TMRAccumulator(latents)
+
+    with data_access.connection(args.database) as conn:
+        added = accumulator.update_from_database(conn)
+        passed = screen_participants(conn) if args.passed_only else None
+    accumulator.save(args.state)
+    print(f'✓ Added {added} trials, state saved to {args.state}')
+
+    summary = accumulator.summary()
+    if passed is not None:
+        summary = summary[summary['worker_id'].isin(passed)]
+        print(f"{len(summary)} participants pass the screening checks")
+    print(summary.to_string(index=False))
+    print("\nParticipants per condition:")
+    print(summary.groupby('condition').size())
+
+
+if __name__ == "__main__":
+    main()